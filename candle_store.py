@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+# Константы
+CANDLE_INTERVAL_MS = 86400000  # Дневная свеча
+KLINES_PAGE_LIMIT = 1000  # Максимум свечей в одном ответе Binance /klines
+KLINES_UPDATE_LIMIT = 2  # Инкрементальное обновление: последняя закрытая и текущая свеча
+CANDLE_REFRESH_INTERVAL = 60  # Как часто дозапрашивать текущую свечу, сек
+
+def percent_change(current, reference):
+    if reference is None:
+        return None
+    return ((current - reference) / reference * 100) if reference != 0 else Decimal('0')
+
+def format_day(open_time):
+    return datetime.fromtimestamp(open_time / 1000, tz=timezone.utc).strftime("%d.%m.%Y")
+
+class CandleSeries:
+    """Дневные OHLC свечи одного символа и готовые метрики (7д, 30д, от ATH, ATH/ATL)"""
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.open_times = []
+        self.opens = []
+        self.highs = []
+        self.lows = []
+        self.closes = []
+        self.ath = None  # (цена, open_time свечи)
+        self.atl = None
+        self.metrics = None
+        self.updated = 0
+
+    def __len__(self):
+        return len(self.open_times)
+
+    def apply(self, klines):
+        """Добавление свечей Binance [openTime, open, high, low, close, ...]; текущая свеча заменяется новой версией"""
+        for kline in klines:
+            open_time = kline[0]
+            if self.open_times and open_time < self.open_times[-1]:
+                continue  # Уже есть
+            high = Decimal(kline[2])
+            low = Decimal(kline[3])
+            if self.open_times and open_time == self.open_times[-1]:
+                self.highs[-1] = high
+                self.lows[-1] = low
+                self.closes[-1] = Decimal(kline[4])
+            else:
+                self.open_times.append(open_time)
+                self.opens.append(Decimal(kline[1]))
+                self.highs.append(high)
+                self.lows.append(low)
+                self.closes.append(Decimal(kline[4]))
+            # Максимум/минимум формирующейся свечи только расширяются, поэтому экстремумы считаем инкрементально
+            if self.ath is None or high > self.ath[0]:
+                self.ath = (high, open_time)
+            if self.atl is None or low < self.atl[0]:
+                self.atl = (low, open_time)
+        self.updated = time.monotonic()
+        self._compute_metrics()
+
+    def close_days_ago(self, days):
+        """Цена закрытия свечи days дней назад от последней, или самая ранняя, если истории меньше"""
+        if not self.closes:
+            return None
+        return self.closes[max(0, len(self.closes) - 1 - days)]
+
+    def _compute_metrics(self):
+        if not self.closes:
+            self.metrics = None
+            return
+        price = self.closes[-1]
+        self.metrics = {
+            "price": price,
+            "change_7d": percent_change(price, self.close_days_ago(7)),
+            "change_30d": percent_change(price, self.close_days_ago(30)),
+            "change_all": percent_change(price, self.ath[0]),
+            "ath": (self.ath[0], format_day(self.ath[1])),
+            "atl": (self.atl[0], format_day(self.atl[1]))
+        }
+
+class CandleStore:
+    """Локальное хранилище дневных свечей: полная история загружается один раз, дальше — только последняя свеча"""
+    def __init__(self, fetch, refresh_interval=CANDLE_REFRESH_INTERVAL):
+        self.fetch = fetch  # async fetch(params) -> (status, klines)
+        self.refresh_interval = refresh_interval
+        self.series = {}
+        self.inflight = {}  # symbol -> asyncio.Task
+
+    def metrics(self, symbol):
+        series = self.series.get(symbol)
+        return series.metrics if series is not None else None
+
+    async def get_metrics(self, symbol):
+        """Готовые метрики символа; при необходимости сначала догружаются свечи"""
+        series = self.series.get(symbol)
+        if series is None or time.monotonic() - series.updated >= self.refresh_interval:
+            task = self.inflight.get(symbol)
+            if task is None or task.done():
+                task = asyncio.ensure_future(self._update(symbol))
+                self.inflight[symbol] = task
+            try:
+                await asyncio.shield(task)
+            except Exception as e:
+                logger.error(f"Ошибка обновления свечей {symbol}: {str(e)}")
+        return self.metrics(symbol)
+
+    async def _update(self, symbol):
+        try:
+            series = self.series.get(symbol)
+            if series is None or not len(series):
+                series = await self._backfill(symbol)
+                if series is not None:
+                    self.series[symbol] = series
+                return
+            status, klines = await self.fetch({"symbol": symbol, "interval": "1d", "limit": KLINES_UPDATE_LIMIT})
+            if status != 200:
+                logger.warning(f"Binance klines вернул ошибку для {symbol}: {status}")
+                return
+            series.apply(klines)
+        finally:
+            self.inflight.pop(symbol, None)
+
+    async def _backfill(self, symbol):
+        """Вся дневная история символа постранично"""
+        series = CandleSeries(symbol)
+        start_time = 0
+        while True:
+            status, klines = await self.fetch({"symbol": symbol, "interval": "1d", "startTime": start_time, "limit": KLINES_PAGE_LIMIT})
+            if status != 200:
+                logger.warning(f"Binance klines backfill вернул ошибку для {symbol}: {status}")
+                return None
+            series.apply(klines)
+            if len(klines) < KLINES_PAGE_LIMIT:
+                break
+            start_time = klines[-1][0] + CANDLE_INTERVAL_MS
+        logger.info(f"Candles backfilled for {symbol}: {len(series)} days")
+        return series
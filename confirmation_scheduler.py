@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class PendingConfirmation:
+    """Незавершённое подтверждение пересечения уровня"""
+    __slots__ = ('chat_id', 'target_level', 'direction', 'count', 'values', 'started', 'deadline', 'last_block', 'last_time', 'seq')
+
+    def __init__(self, chat_id, target_level, direction, sample, window):
+        self.chat_id = chat_id
+        self.target_level = target_level
+        self.direction = direction
+        self.count = 1
+        self.values = [sample.value]
+        self.started = time.time()
+        self.deadline = self.started + window
+        self.last_block = sample.block
+        self.last_time = sample.timestamp
+        self.seq = None
+
+    def on_side(self, value):
+        return value <= self.target_level if self.direction == 'down' else value >= self.target_level
+
+    def stats(self):
+        return {
+            "chat_id": self.chat_id,
+            "level": self.target_level,
+            "direction": self.direction,
+            "samples": self.count,
+            "age": round(time.time() - self.started, 1)
+        }
+
+class ConfirmationScheduler:
+    """Все незавершённые подтверждения в одном месте: словарь записей и куча дедлайнов с ленивым удалением"""
+    def __init__(self):
+        self.pending = {}  # (chat_id, level) -> PendingConfirmation
+        self.by_user = {}  # chat_id -> set(level)
+        self.heap = []  # (deadline, seq, key)
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, key):
+        return key in self.pending
+
+    def add(self, confirmation):
+        """Новое подтверждение; прежнее для того же уровня заменяется, его запись в куче становится пустой"""
+        key = (confirmation.chat_id, confirmation.target_level)
+        confirmation.seq = next(self.counter)
+        self.pending[key] = confirmation
+        self.by_user.setdefault(confirmation.chat_id, set()).add(confirmation.target_level)
+        heapq.heappush(self.heap, (confirmation.deadline, confirmation.seq, key))
+        if self.heap[0][1] == confirmation.seq:
+            self.wakeup.set()  # Новый ближайший дедлайн
+
+    def remove(self, chat_id, level):
+        """Отмена за O(1): запись в куче пропускается при извлечении"""
+        confirmation = self.pending.pop((chat_id, level), None)
+        if confirmation is not None:
+            levels = self.by_user.get(chat_id)
+            levels.discard(level)
+            if not levels:
+                del self.by_user[chat_id]
+        return confirmation
+
+    def cancel_user(self, chat_id):
+        for level in list(self.by_user.get(chat_id, ())):
+            self.remove(chat_id, level)
+
+    def active(self):
+        return list(self.pending.values())
+
+    def pop_due(self, now):
+        """Подтверждения с истёкшим окном, пачкой"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self.heap)
+            confirmation = self.pending.get(key)
+            if confirmation is not None and confirmation.seq == seq:
+                self.remove(*key)
+                due.append(confirmation)
+        return due
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "users": len(self.by_user),
+            "heap": len(self.heap),
+            "confirmations": [confirmation.stats() for confirmation in self.pending.values()]
+        }
+
+    async def run(self, on_due):
+        """Один таймер на все подтверждения: спит до ближайшего дедлайна и обрабатывает истёкшие пачкой"""
+        while True:
+            self.wakeup.clear()
+            timeout = max(0, self.heap[0][0] - time.time()) if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                continue  # Появился более ранний дедлайн
+            except asyncio.TimeoutError:
+                pass
+            for confirmation in self.pop_due(time.time()):
+                try:
+                    await on_due(confirmation)
+                except Exception as e:
+                    logger.error(f"Error finishing confirmation for chat_id={confirmation.chat_id}: {str(e)}")
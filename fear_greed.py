@@ -0,0 +1,141 @@
+import logging
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Константы
+FEAR_GREED_URL = "https://pro-api.coinmarketcap.com/v3/fear-and-greed/historical"
+FEAR_GREED_BACKFILL_LIMIT = 400  # Первичная загрузка: год с запасом (лимит CMC — 500 точек)
+FEAR_GREED_UPDATE_LIMIT = 2  # Обновление: сегодня и вчера (больше, если бот не работал несколько дней)
+FEAR_GREED_HISTORY_DAYS = 366  # Сколько дневных точек хранить
+DAY = 86400
+# Окна экстремумов, дней
+FEAR_GREED_WINDOWS = {
+    "week": 7,
+    "month": 30,
+    "year": 365
+}
+
+# Одна дневная точка индекса: время (unix, начало дня), значение и категория
+FearGreedPoint = namedtuple('FearGreedPoint', ['timestamp', 'value', 'category'])
+
+def parse_timestamp(ts):
+    try:
+        return int(ts)
+    except ValueError:
+        return int(datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc).timestamp())
+
+def format_date(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y")
+
+def points_from_response(data):
+    """Точки из ответа CMC /fear-and-greed/historical"""
+    return [FearGreedPoint(parse_timestamp(d["timestamp"]), int(d["value"]), d["value_classification"]) for d in data]
+
+class WindowExtremes:
+    """Максимум и минимум за скользящее окно на монотонных деках: O(1) на запрос, амортизированно O(1) на точку"""
+    def __init__(self, days):
+        self.width = days * DAY
+        self.maxs = deque()
+        self.mins = deque()
+
+    def push(self, point):
+        # При равных значениях остаётся более свежая точка
+        while self.maxs and self.maxs[-1].value <= point.value:
+            self.maxs.pop()
+        self.maxs.append(point)
+        while self.mins and self.mins[-1].value >= point.value:
+            self.mins.pop()
+        self.mins.append(point)
+
+    def expire(self, now):
+        while self.maxs and self.maxs[0].timestamp <= now - self.width:
+            self.maxs.popleft()
+        while self.mins and self.mins[0].timestamp <= now - self.width:
+            self.mins.popleft()
+
+    def extremes(self, current):
+        """(max, min) с учётом текущей, ещё меняющейся точки"""
+        high = self.maxs[0] if self.maxs and self.maxs[0].value > current.value else current
+        low = self.mins[0] if self.mins and self.mins[0].value < current.value else current
+        return high, low
+
+class FearGreedHistory:
+    """Дневная история индекса страха и жадности: загружается один раз (из storage или CMC), дальше дополняется новыми точками"""
+    def __init__(self, max_days=FEAR_GREED_HISTORY_DAYS):
+        self.max_days = max_days
+        self.points = deque(maxlen=max_days)  # По возрастанию времени, последняя точка — текущая
+        self.windows = {name: WindowExtremes(days) for name, days in FEAR_GREED_WINDOWS.items()}
+        self.needs_backfill = False  # В сохранённой истории есть пропуски — нужна полная загрузка
+
+    def __len__(self):
+        return len(self.points)
+
+    def load(self, points):
+        """Начальное заполнение сохранённой историей из storage"""
+        self.rebuild(points)
+        self.needs_backfill = self.has_gap()
+        if self.needs_backfill:
+            logger.warning("Stored Fear & Greed history has gaps, full backfill scheduled")
+
+    def rebuild(self, points):
+        """История заново из points (например, сохранённые + полная загрузка из CMC); при совпадении дня побеждает более поздняя в списке"""
+        by_day = {point.timestamp: point for point in points}
+        self.points = deque(maxlen=self.max_days)
+        self.windows = {name: WindowExtremes(days) for name, days in FEAR_GREED_WINDOWS.items()}
+        self.apply(by_day.values())
+        self.needs_backfill = False
+
+    def has_gap(self):
+        return any(later.timestamp - earlier.timestamp > DAY for earlier, later in zip(self.points, list(self.points)[1:]))
+
+    def fetch_limit(self, now=None):
+        """Сколько последних точек запросить у CMC: полная загрузка для пустой или дырявой истории, иначе — дни с последней точки"""
+        if not self.points or self.needs_backfill:
+            return FEAR_GREED_BACKFILL_LIMIT
+        missed_days = int(((now or time.time()) - self.points[-1].timestamp) // DAY)
+        return min(FEAR_GREED_BACKFILL_LIMIT, max(FEAR_GREED_UPDATE_LIMIT, missed_days + 1))
+
+    def apply(self, points):
+        """Добавление точек в любом порядке; точка за текущий день заменяет прежнюю версию"""
+        for point in sorted(points):
+            if not self.points or point.timestamp > self.points[-1].timestamp:
+                if self.points:
+                    # Предыдущий день закрыт — теперь он входит в окна
+                    for window in self.windows.values():
+                        window.push(self.points[-1])
+                self.points.append(point)
+                for window in self.windows.values():
+                    window.expire(point.timestamp)
+            elif point.timestamp == self.points[-1].timestamp:
+                self.points[-1] = point
+
+    def days_ago(self, days):
+        """Точка days дней назад от текущей или самая ранняя, если истории меньше"""
+        return self.points[max(0, len(self.points) - 1 - days)]
+
+    def snapshot(self):
+        """Текущее значение, значения в прошлом и экстремумы по окнам"""
+        if not self.points:
+            return None
+        current = self.points[-1]
+        result = {
+            "current": {"value": current.value, "category": current.category},
+            "yesterday": self._describe(self.days_ago(1)),
+            "week_ago": self._describe(self.days_ago(7)),
+            "month_ago": self._describe(self.days_ago(30))
+        }
+        for name, window in self.windows.items():
+            high, low = window.extremes(current)
+            result[f"{name}_max"] = self._describe(high, with_date=True)
+            result[f"{name}_min"] = self._describe(low, with_date=True)
+        return result
+
+    @staticmethod
+    def _describe(point, with_date=False):
+        result = {"value": point.value, "category": point.category}
+        if with_date:
+            result["date"] = format_date(point.timestamp)
+        return result
@@ -0,0 +1,169 @@
+import logging
+import math
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Константы
+RAW_CAPACITY = 4096  # Сколько последних сырых замеров хранить
+HIST_BINS = 96  # Число корзин логарифмической гистограммы для перцентилей (~7.5% на корзину)
+HIST_MIN_GWEI = 1e-6  # Нижняя граница гистограммы
+HIST_MAX_GWEI = 1.0  # Верхняя граница гистограммы
+# (ширина корзины в секундах, сколько корзин хранить)
+ROLLUPS = {
+    "1m": (60, 1440),  # сутки
+    "1h": (3600, 720),  # 30 дней
+    "1d": (86400, 365)  # год
+}
+
+_LOG_MIN = math.log10(HIST_MIN_GWEI)
+_LOG_STEP = (math.log10(HIST_MAX_GWEI) - _LOG_MIN) / HIST_BINS
+
+def value_to_bin(value):
+    if value <= HIST_MIN_GWEI:
+        return 0
+    return min(HIST_BINS - 1, int((math.log10(value) - _LOG_MIN) / _LOG_STEP))
+
+def bin_to_value(index):
+    """Геометрическая середина корзины"""
+    return 10 ** (_LOG_MIN + (index + 0.5) * _LOG_STEP)
+
+class GasRollup:
+    """Кольцевой буфер агрегатов газа (count/sum/min/max и гистограмма) фиксированной ширины"""
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.bucket_ids = array('q', [-1]) * capacity
+        self.counts = array('I', [0]) * capacity
+        self.sums = array('d', [0.0]) * capacity
+        self.mins = array('d', [0.0]) * capacity
+        self.maxs = array('d', [0.0]) * capacity
+        self.hist = array('I', [0]) * (capacity * HIST_BINS)
+
+    def add(self, timestamp, value, value_bin):
+        bucket_id = int(timestamp // self.width)
+        slot = bucket_id % self.capacity
+        if self.bucket_ids[slot] != bucket_id:
+            if self.bucket_ids[slot] > bucket_id:
+                return  # Замер старше данных в слоте — уже вытеснен
+            self.bucket_ids[slot] = bucket_id
+            self.counts[slot] = 0
+            self.sums[slot] = 0.0
+            self.mins[slot] = value
+            self.maxs[slot] = value
+            offset = slot * HIST_BINS
+            self.hist[offset:offset + HIST_BINS] = array('I', [0]) * HIST_BINS
+        self.counts[slot] += 1
+        self.sums[slot] += value
+        if value < self.mins[slot]:
+            self.mins[slot] = value
+        if value > self.maxs[slot]:
+            self.maxs[slot] = value
+        self.hist[slot * HIST_BINS + value_bin] += 1
+
+    def covers(self, start, now):
+        """Хранит ли уровень данные начиная с start"""
+        return int(now // self.width) - int(start // self.width) < self.capacity
+
+    def slots(self, start, end):
+        """Заполненные слоты в диапазоне [start, end] по возрастанию времени"""
+        first = int(start // self.width)
+        last = int(end // self.width)
+        first = max(first, last - self.capacity + 1)
+        for bucket_id in range(first, last + 1):
+            slot = bucket_id % self.capacity
+            if self.bucket_ids[slot] == bucket_id and self.counts[slot]:
+                yield slot
+
+class GasHistory:
+    """Хранилище истории газа: сырые замеры и агрегаты 1m/1h/1d с ограниченным объёмом памяти"""
+    def __init__(self, raw_capacity=RAW_CAPACITY):
+        self.raw_capacity = raw_capacity
+        self.raw_timestamps = array('d', [0.0]) * raw_capacity
+        self.raw_values = array('d', [0.0]) * raw_capacity
+        self.raw_index = 0
+        self.raw_size = 0
+        self.last_timestamp = 0.0
+        self.rollups = {name: GasRollup(width, capacity) for name, (width, capacity) in ROLLUPS.items()}
+        logger.info("GasHistory initialized")
+
+    def add(self, timestamp, value):
+        value = float(value)
+        self.raw_timestamps[self.raw_index] = timestamp
+        self.raw_values[self.raw_index] = value
+        self.raw_index = (self.raw_index + 1) % self.raw_capacity
+        self.raw_size = min(self.raw_size + 1, self.raw_capacity)
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+        value_bin = value_to_bin(value)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, value, value_bin)
+
+    def add_sample(self, sample):
+        """Слушатель gas_bus"""
+        self.add(sample.timestamp, sample.value)
+
+    def raw(self, start, end):
+        """Сырые замеры (timestamp, value) в диапазоне [start, end]"""
+        result = []
+        first = (self.raw_index - self.raw_size) % self.raw_capacity
+        for i in range(self.raw_size):
+            index = (first + i) % self.raw_capacity
+            timestamp = self.raw_timestamps[index]
+            if start <= timestamp <= end:
+                result.append((timestamp, self.raw_values[index]))
+        return result
+
+    def pick_resolution(self, start):
+        """Самое подробное разрешение, которое ещё хранит данные с момента start"""
+        now = self.last_timestamp or time.time()
+        for name, rollup in self.rollups.items():
+            if rollup.covers(start, now):
+                return name
+        return list(self.rollups)[-1]
+
+    def series(self, start, end, resolution=None):
+        """Агрегаты по корзинам: список (bucket_start, count, min, max, mean)"""
+        rollup = self.rollups[resolution or self.pick_resolution(start)]
+        return [
+            (rollup.bucket_ids[slot] * rollup.width, rollup.counts[slot], rollup.mins[slot], rollup.maxs[slot], rollup.sums[slot] / rollup.counts[slot])
+            for slot in rollup.slots(start, end)
+        ]
+
+    def summary(self, start, end, percentiles=(50, 90, 99), resolution=None):
+        """min/max/mean и перцентили за диапазон за O(корзин)"""
+        rollup = self.rollups[resolution or self.pick_resolution(start)]
+        count = 0
+        total = 0.0
+        low = None
+        high = None
+        hist = [0] * HIST_BINS
+        for slot in rollup.slots(start, end):
+            count += rollup.counts[slot]
+            total += rollup.sums[slot]
+            low = rollup.mins[slot] if low is None else min(low, rollup.mins[slot])
+            high = rollup.maxs[slot] if high is None else max(high, rollup.maxs[slot])
+            offset = slot * HIST_BINS
+            for i, bin_count in enumerate(rollup.hist[offset:offset + HIST_BINS]):
+                if bin_count:
+                    hist[i] += bin_count
+        if not count:
+            return None
+        result = {"count": count, "min": low, "max": high, "mean": total / count}
+        for q in percentiles:
+            result[f"p{q}"] = self._percentile_from_hist(hist, count, q, low, high)
+        return result
+
+    def percentile(self, q, start, end, resolution=None):
+        summary = self.summary(start, end, percentiles=(q,), resolution=resolution)
+        return summary[f"p{q}"] if summary else None
+
+    @staticmethod
+    def _percentile_from_hist(hist, count, q, low, high):
+        rank = q / 100 * count
+        seen = 0
+        for i, bin_count in enumerate(hist):
+            seen += bin_count
+            if seen >= rank and bin_count:
+                return min(max(bin_to_value(i), low), high)
+        return high
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Константы
+HTTP_LIMIT = 100  # Всего открытых соединений
+HTTP_LIMIT_PER_HOST = 10  # Соединений на один хост
+HTTP_DNS_TTL = 300  # Время жизни DNS кэша, сек
+HTTP_KEEPALIVE = 60  # Сколько держать простаивающее соединение, сек
+HTTP_TIMEOUT_TOTAL = 15  # Таймаут запроса по умолчанию, сек
+HTTP_TIMEOUT_CONNECT = 5  # Таймаут установки соединения, сек
+HTTP_WARMUP_TIMEOUT = 5  # Таймаут прогрева одного хоста, сек
+HTTP_ROTATE_GRACE = 30  # Сколько старая сессия живёт после ротации, чтобы дождаться начатых запросов, сек
+
+class HttpClient:
+    """Общий для процесса aiohttp клиент: пул соединений, keep-alive, DNS кэш и таймауты по умолчанию"""
+    def __init__(self):
+        self.session = None
+        self.lock = asyncio.Lock()
+
+    async def get_session(self):
+        """Общая ClientSession, создаётся при первом обращении"""
+        if self.session is not None and not self.session.closed:
+            return self.session
+        async with self.lock:
+            if self.session is None or self.session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=HTTP_LIMIT,
+                    limit_per_host=HTTP_LIMIT_PER_HOST,
+                    ttl_dns_cache=HTTP_DNS_TTL,
+                    keepalive_timeout=HTTP_KEEPALIVE
+                )
+                timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT_TOTAL, connect=HTTP_TIMEOUT_CONNECT)
+                self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+                logger.info("Shared HTTP session initialized")
+        return self.session
+
+    async def warmup(self, urls):
+        """Прогрев DNS и TLS соединений к хостам заранее, ошибки не критичны"""
+        session = await self.get_session()
+
+        async def touch(url):
+            try:
+                async with session.head(url, timeout=aiohttp.ClientTimeout(total=HTTP_WARMUP_TIMEOUT)) as resp:
+                    logger.debug(f"Warmed up {url}: {resp.status}")
+            except Exception as e:
+                logger.debug(f"Warmup failed for {url}: {str(e)}")
+
+        await asyncio.gather(*(touch(url) for url in urls))
+        logger.info(f"HTTP connections warmed up for {len(urls)} hosts")
+
+    async def rotate(self, grace=HTTP_ROTATE_GRACE):
+        """Новая сессия вместо текущей; старая закрывается через grace секунд"""
+        async with self.lock:
+            old, self.session = self.session, None
+        session = await self.get_session()
+        if old is not None and not old.closed:
+            asyncio.ensure_future(self._close_later(old, grace))
+        logger.info("Shared HTTP session rotated")
+        return session
+
+    @staticmethod
+    async def _close_later(session, delay):
+        await asyncio.sleep(delay)
+        await session.close()
+        logger.debug("Previous HTTP session closed")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("Shared HTTP session closed")
+        self.session = None
+
+http_client = HttpClient()
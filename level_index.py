@@ -0,0 +1,69 @@
+import math
+from bisect import bisect_left, bisect_right, insort
+
+class LevelIndex:
+    """Уровни уведомлений одного пользователя по возрастанию для поиска пересечений бинарным поиском"""
+    def __init__(self, levels=()):
+        self.levels = sorted(levels)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def update(self, levels):
+        self.levels = sorted(levels)
+
+    def crossed(self, prev, current):
+        """Уровни, пересечённые при переходе prev -> current, в порядке пересечения: (direction, [уровни]).
+        Вверх — prev < уровень <= current, вниз — prev > уровень >= current"""
+        if current > prev:
+            return 'up', self.levels[bisect_right(self.levels, prev):bisect_right(self.levels, current)]
+        if current < prev:
+            return 'down', self.levels[bisect_left(self.levels, current):bisect_left(self.levels, prev)][::-1]
+        return None, []
+
+    def closest(self, value):
+        """Ближайший к value уровень или None"""
+        if not self.levels:
+            return None
+        index = bisect_left(self.levels, value)
+        candidates = self.levels[max(0, index - 1):index + 1]
+        return min(candidates, key=lambda level: abs(level - value))
+
+    def bounds(self, anchor):
+        """Ближайшие уровни ниже и выше anchor: пока газ между ними, пересечений нет"""
+        lower_index = bisect_left(self.levels, anchor) - 1
+        upper_index = bisect_right(self.levels, anchor)
+        lower = self.levels[lower_index] if lower_index >= 0 else None
+        upper = self.levels[upper_index] if upper_index < len(self.levels) else None
+        return lower, upper
+
+class LevelAlertIndex:
+    """Общий для всех пользователей индекс интервалов без пересечений: замер газа затрагивает только тех, чей интервал он покинул"""
+    def __init__(self):
+        self.lowers = []  # (нижняя граница, user_id) по возрастанию
+        self.uppers = []  # (верхняя граница, user_id) по возрастанию
+        self.bounds = {}  # user_id -> (нижняя, верхняя)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def update(self, user_id, lower, upper):
+        self.remove(user_id)
+        self.bounds[user_id] = (lower, upper)
+        if lower is not None:
+            insort(self.lowers, (lower, user_id))
+        if upper is not None:
+            insort(self.uppers, (upper, user_id))
+
+    def remove(self, user_id):
+        lower, upper = self.bounds.pop(user_id, (None, None))
+        if lower is not None:
+            del self.lowers[bisect_left(self.lowers, (lower, user_id))]
+        if upper is not None:
+            del self.uppers[bisect_left(self.uppers, (upper, user_id))]
+
+    def affected(self, value):
+        """Пользователи, у которых value вышло за интервал: верхняя граница <= value или нижняя >= value"""
+        users = {user_id for _, user_id in self.uppers[:bisect_right(self.uppers, (value, math.inf))]}
+        users.update(user_id for _, user_id in self.lowers[bisect_left(self.lowers, (value, -math.inf)):])
+        return users
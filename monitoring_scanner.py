@@ -1,9 +1,18 @@
 import asyncio
+import json
 import logging
-from web3 import AsyncWeb3, AsyncHTTPProvider
+import math
+import time
+from collections import deque, namedtuple
+from web3 import AsyncWeb3, AsyncHTTPProvider, WebSocketProvider
 from decimal import Decimal
 import aiohttp
-from datetime import datetime
+from urllib.parse import urlencode, urlparse
+from candle_store import CandleStore
+from gas_history import GasHistory
+from http_client import http_client
+from token_registry import registry
+from request_scheduler import ProviderScheduler, PRIORITY_USER, PRIORITY_BACKGROUND
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,93 +23,703 @@ logger = logging.getLogger(__name__)
 
 # Константы
 RPC_URL = "https://pacific-rpc.manta.network/http"
-BINANCE_API_URL = "https://api.binance.com/api/v3/ticker/24hr?symbol=MANTAUSDT"
-BINANCE_FUTURES_API_URL = "https://fapi.binance.com/fapi/v1/ticker/24hr?symbol=MANTAUSDT"
-COINGECKO_API_URL_30D = "https://api.coingecko.com/api/v3/coins/manta-network/market_chart?vs_currency=usd&days=30&interval=daily"
-COINGECKO_API_URL_ALL = "https://api.coingecko.com/api/v3/coins/manta-network?localization=false&tickers=false&market_data=true"
+MANTA_CHAIN_ID = 169
+RPC_URLS = [
+    RPC_URL,
+    "https://manta-pacific.drpc.org",
+    "https://1rpc.io/manta"
+]
+WS_RPC_URL = "wss://pacific-rpc.manta.network/ws"
+BINANCE_TICKER_URLS = {
+    "spot": "https://api.binance.com/api/v3/ticker/24hr",
+    "futures": "https://fapi.binance.com/fapi/v1/ticker/24hr"
+}
+BINANCE_STREAM_URLS = {
+    "spot": "wss://stream.binance.com:9443/stream?streams=",
+    "futures": "wss://fstream.binance.com/stream?streams="
+}
+# Символы, котировки которых держим в памяти по WebSocket
+BINANCE_STREAM_SYMBOLS = {
+    "spot": registry.binance_symbols("l2"),
+    "futures": ["MANTAUSDT"]
+}
+BINANCE_QUOTE_MAX_AGE = 60  # Котировка из потока считается свежей столько секунд
+BINANCE_WS_HEARTBEAT = 30  # Интервал ping для WebSocket Binance, сек
+BINANCE_KLINES_URL = "https://api.binance.com/api/v3/klines"
+GAS_BUS_BUFFER_SIZE = 256  # Сколько последних замеров газа хранить в кольцевом буфере
+GAS_BUS_QUEUE_SIZE = 64  # Размер очереди одного подписчика
+WS_RECONNECT_MIN = 1  # Начальная пауза перед переподключением WebSocket, сек
+WS_RECONNECT_MAX = 60  # Максимальная пауза перед переподключением WebSocket, сек
+WS_HEAD_TIMEOUT = 30  # Если за это время не пришло ни одного блока, соединение считается мёртвым
+WS_PRIORITY_FEE_TTL = 15  # Как часто обновлять приоритетную комиссию в потоковом режиме, сек
+GWEI = Decimal('1000000000')
+FEE_HISTORY_MAX_BLOCKS = 1024  # Лимит блоков в одном eth_feeHistory у большинства узлов
+FEE_HISTORY_BACKFILL_CHUNKS = 4  # Максимум запросов на дозагрузку пропущенных блоков за один опрос
+BLOCK_TIME_ESTIMATE = 2.0  # Начальная оценка времени блока, сек
+CACHE_TTL_BINANCE = 10  # Время жизни ответов Binance в кэше, сек
+CACHE_TTL_COINGECKO_MARKETS = 60  # /coins/markets для конвертера и сравнения L2
+COINGECKO_MARKETS_URL = "https://api.coingecko.com/api/v3/coins/markets"
+COINGECKO_MARKETS_PAGE_SIZE = 250  # Максимум монет в одном ответе /coins/markets
+# Бюджет запросов в минуту для провайдеров с жёсткими лимитами (с запасом до лимита бесплатного тарифа)
+PROVIDER_RATE_LIMITS = {
+    "api.coingecko.com": 25,
+    "pro-api.coinmarketcap.com": 25
+}
+UPSTREAM_TIMEOUT = 5  # Дедлайн одного запроса к внешнему API, сек
+CACHE_STALE_FACTOR = 10  # Сколько TTL после устаревания ещё можно отдавать старые данные, пока идёт обновление
+RPC_LATENCY_WINDOW = 100  # Сколько последних запросов учитывать в p95 и доле ошибок
+RPC_EWMA_ALPHA = 0.2  # Вес нового замера задержки в EWMA
+RPC_HEDGE_DEFAULT = 1.0  # Дедлайн для дублирующего запроса, пока статистики мало, сек
+RPC_HEDGE_MIN = 0.2  # Минимальный дедлайн для дублирующего запроса, сек
+RPC_MAX_ERROR_RATE = 0.5  # Узел с большей долей ошибок считается нездоровым
+RPC_UNHEALTHY_COOLDOWN = 30  # Через сколько секунд после последней ошибки нездоровый узел снова пробуется
+
+# Один замер газа: время (unix), значение в Gwei и номер блока (если известен)
+GasSample = namedtuple('GasSample', ['timestamp', 'value', 'block'])
+
+class GasSampleBus:
+    """Общая шина замеров газа: один запрос к RPC на всех читателей"""
+    def __init__(self, fetch, maxlen=GAS_BUS_BUFFER_SIZE):
+        # fetch возвращает список новых замеров (по одному на блок) или None
+        self.fetch = fetch
+        self.samples = deque(maxlen=maxlen)
+        self.subscribers = set()
+        self.listeners = []
+        self.inflight = None
+
+    def latest(self):
+        """Последний замер или None"""
+        return self.samples[-1] if self.samples else None
+
+    def subscribe(self, maxsize=GAS_BUS_QUEUE_SIZE):
+        """Подписка на новые замеры, возвращает очередь"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.add(queue)
+        logger.debug(f"Gas bus subscriber added, total={len(self.subscribers)}")
+        return queue
+
+    def add_listener(self, listener):
+        """Синхронный слушатель, вызывается на каждый замер (например, запись в историю)"""
+        self.listeners.append(listener)
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        logger.debug(f"Gas bus subscriber removed, total={len(self.subscribers)}")
+
+    def publish(self, sample):
+        """Сохранение замера в буфере и рассылка подписчикам"""
+        self.samples.append(sample)
+        for listener in self.listeners:
+            try:
+                listener(sample)
+            except Exception as e:
+                logger.error(f"Gas bus listener error: {str(e)}")
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()  # Медленный подписчик теряет самый старый замер
+            queue.put_nowait(sample)
+
+    async def sample(self, max_age=0):
+        """Свежий замер газа: из буфера, если он не старше max_age секунд, иначе один общий запрос к RPC"""
+        latest = self.latest()
+        if latest is not None and max_age and time.time() - latest.timestamp <= max_age:
+            return latest
+        if self.inflight is None or self.inflight.done():
+            self.inflight = asyncio.ensure_future(self._fetch_and_publish())
+        return await asyncio.shield(self.inflight)
+
+    async def _fetch_and_publish(self):
+        samples = await self.fetch()
+        if samples is None:
+            return None  # Запрос не удался
+        if not samples:
+            return self.latest()  # Новых блоков нет — последний замер по-прежнему актуален
+        for sample in samples:
+            self.publish(sample)
+        return samples[-1]
+
+class UpstreamError(Exception):
+    """Внешний API ответил не 200"""
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"Upstream returned status {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+class MarketDataCache:
+    """TTL кэш ответов внешних API: stale-while-revalidate и один запрос на все одновременные промахи"""
+    def __init__(self):
+        self.entries = {}  # key -> (value, fetched_at)
+        self.inflight = {}  # key -> asyncio.Task
+
+    async def get(self, key, fetch, ttl, stale_ttl=None):
+        stale_ttl = ttl * CACHE_STALE_FACTOR if stale_ttl is None else stale_ttl
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < ttl:
+                return value
+            if age < ttl + stale_ttl:
+                self.refresh(key, fetch)  # Отдаём старые данные, обновляем в фоне
+                return value
+        try:
+            return await asyncio.shield(self.refresh(key, fetch))
+        except Exception:
+            if entry is not None:
+                logger.warning(f"Serving expired cache for {key} after upstream error")
+                return entry[0]
+            raise
+
+    def refresh(self, key, fetch):
+        """Запуск обновления ключа, если оно ещё не идёт"""
+        task = self.inflight.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            task.add_done_callback(self._log_refresh_error)
+            self.inflight[key] = task
+        return task
+
+    async def _fetch(self, key, fetch):
+        try:
+            value = await fetch()
+            self.entries[key] = (value, time.monotonic())
+            return value
+        finally:
+            self.inflight.pop(key, None)
+
+    @staticmethod
+    def _log_refresh_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Cache refresh failed: {task.exception()}")
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+class CoinMarketsPlanner:
+    """Сбор id монет от всех потребителей и минимальное число запросов /coins/markets за цикл обновления"""
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.consumers = {}  # name -> (ids, callback)
+
+    def register(self, name, ids, callback):
+        """callback(rows) получает {coin_id: строка /coins/markets} для своих id"""
+        self.consumers[name] = (list(ids), callback)
+
+    def plan(self):
+        """Страницы id: ceil(уникальных id / 250) запросов"""
+        ids = sorted({coin_id for coin_ids, _ in self.consumers.values() for coin_id in coin_ids})
+        return [ids[i:i + COINGECKO_MARKETS_PAGE_SIZE] for i in range(0, len(ids), COINGECKO_MARKETS_PAGE_SIZE)]
+
+    async def refresh(self, priority=PRIORITY_BACKGROUND, timeout=UPSTREAM_TIMEOUT):
+        pages = self.plan()
+        results = await asyncio.gather(*(
+            self.scanner.fetch_json(COINGECKO_MARKETS_URL, CACHE_TTL_COINGECKO_MARKETS, params={
+                "vs_currency": "usd",
+                "ids": ",".join(page),
+                "order": "market_cap_desc",
+                "per_page": COINGECKO_MARKETS_PAGE_SIZE,
+                "page": 1,
+                "sparkline": "false",
+                "price_change_percentage": "24h,7d,30d"
+            }, timeout=timeout, priority=priority, stale_ttl=0)
+            for page in pages
+        ))
+        rows = {}
+        failed = set()
+        for page, (status, data) in zip(pages, results):
+            if status != 200:
+                logger.warning(f"CoinGecko API error for /coins/markets ({len(page)} ids): {status}")
+                failed.update(page)
+                continue
+            rows.update((coin["id"], coin) for coin in data)
+        for name, (coin_ids, callback) in self.consumers.items():
+            if failed.intersection(coin_ids):
+                logger.warning(f"Skipping {name} update, its /coins/markets page failed")
+                continue
+            callback({coin_id: rows[coin_id] for coin_id in coin_ids if coin_id in rows})
+        logger.debug(f"/coins/markets refreshed: {len(pages)} requests for {len(self.consumers)} consumers")
+
+class RpcEndpoint:
+    """RPC узел со статистикой задержек (EWMA, p95) и ошибок"""
+    def __init__(self, url):
+        self.url = url
+        self.web3 = AsyncWeb3(AsyncHTTPProvider(url))
+        self.ewma_latency = None
+        self.latencies = deque(maxlen=RPC_LATENCY_WINDOW)
+        self.outcomes = deque(maxlen=RPC_LATENCY_WINDOW)
+        self.requests = 0
+        self.last_error_time = 0
+
+    def record(self, latency, ok):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.record_latency(latency)
+        else:
+            self.last_error_time = time.monotonic()
+
+    def record_latency(self, latency):
+        """Учёт задержки; для отменённого запроса — нижняя оценка, ответ пришёл бы не раньше"""
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = RPC_EWMA_ALPHA * latency + (1 - RPC_EWMA_ALPHA) * self.ewma_latency
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def p95(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_deadline(self):
+        """Через сколько секунд без ответа отправлять дублирующий запрос на другой узел"""
+        p95 = self.p95()
+        if p95 is None or len(self.latencies) < 10:
+            return RPC_HEDGE_DEFAULT
+        return max(p95, RPC_HEDGE_MIN)
+
+    def is_healthy(self):
+        if self.error_rate() <= RPC_MAX_ERROR_RATE:
+            return True
+        return time.monotonic() - self.last_error_time >= RPC_UNHEALTHY_COOLDOWN
+
+    def stats(self):
+        p95 = self.p95()
+        return {
+            "url": self.url,
+            "healthy": self.is_healthy(),
+            "requests": self.requests,
+            "error_rate": round(self.error_rate(), 3),
+            "ewma_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
+
+class RpcPool:
+    """Пул RPC узлов: запрос к самому быстрому здоровому узлу и дублирующий запрос после p95-дедлайна"""
+    def __init__(self, urls):
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+
+    def ranked(self):
+        """Узлы по возрастанию EWMA задержки, нездоровые — в конце"""
+        def latency(endpoint):
+            return endpoint.ewma_latency if endpoint.ewma_latency is not None else 0.0
+        healthy = sorted((e for e in self.endpoints if e.is_healthy()), key=latency)
+        unhealthy = sorted((e for e in self.endpoints if not e.is_healthy()), key=latency)
+        return healthy + unhealthy
+
+    async def call(self, request):
+        """Выполнение request(endpoint) с маршрутизацией, переключением при ошибке и хеджированием"""
+        candidates = self.ranked()
+        pending = set()
+        started = {}  # task -> (endpoint, monotonic время отправки)
+        last_error = None
+        try:
+            while candidates or pending:
+                timeout = None
+                if candidates:
+                    endpoint = candidates.pop(0)
+                    task = asyncio.ensure_future(self._timed(endpoint, request))
+                    started[task] = (endpoint, time.monotonic())
+                    pending.add(task)
+                    if candidates:
+                        timeout = endpoint.hedge_deadline()
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    self._record_losers(task, pending, started)
+                    return result
+                if not done and candidates:
+                    logger.debug(f"RPC {endpoint.url} exceeded {timeout:.3f}s, sending hedged request to {candidates[0].url}")
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error or ConnectionError("No RPC endpoints available")
+
+    def _record_losers(self, winner, pending, started):
+        """Узлы, проигравшие хеджирование, получают задержку не меньше уже прошедшего времени — иначе медленный узел навсегда остаётся первым"""
+        now = time.monotonic()
+        winner_latency = now - started[winner][1]
+        for task in pending:
+            endpoint, start = started[task]
+            elapsed = now - start
+            if elapsed > winner_latency:  # Запрос, отправленный позже победителя, о скорости узла ничего не говорит
+                endpoint.record_latency(elapsed)
+
+    async def _timed(self, endpoint, request):
+        start = time.monotonic()
+        try:
+            result = await request(endpoint)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            endpoint.record(time.monotonic() - start, False)
+            logger.warning(f"RPC {endpoint.url} error: {str(e)}")
+            raise
+        endpoint.record(time.monotonic() - start, True)
+        return result
+
+    def stats(self):
+        """Статистика по каждому узлу"""
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    async def attach_session(self, session):
+        """Web3 провайдеры узлов используют общую HTTP сессию процесса"""
+        for endpoint in self.endpoints:
+            await endpoint.web3.provider.cache_async_session(session)
+
+async def rpc_batch(session, url, calls):
+    """Несколько JSON-RPC вызовов одним HTTP запросом, calls — список пар (method, params)"""
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+    async with session.post(url, json=payload) as resp:
+        if resp.status != 200:
+            raise ConnectionError(f"RPC {url} вернул ошибку: {resp.status}")
+        data = await resp.json(content_type=None)
+    if not isinstance(data, list):
+        raise ConnectionError(f"RPC {url} не поддерживает batch запросы: {data}")
+    responses = {item.get("id"): item for item in data}
+    results = []
+    for i, (method, _) in enumerate(calls):
+        item = responses.get(i)
+        if item is None or "error" in item:
+            raise ValueError(f"RPC {url} {method} error: {item.get('error') if item else 'no response'}")
+        results.append(item["result"])
+    return results
 
 class Scanner:
     def __init__(self):
-        self.web3 = AsyncWeb3(AsyncHTTPProvider(RPC_URL))
+        self.rpc_pool = RpcPool(RPC_URLS)
+        self.web3 = self.rpc_pool.endpoints[0].web3
         self.session = None  # Session will be initialized asynchronously
+        self.gas_bus = GasSampleBus(self.fetch_gas_samples)
+        self.gas_history = GasHistory()
+        self.gas_bus.add_listener(self.gas_history.add_sample)
+        self.last_block_number = None
+        self.last_poll_time = 0
+        self.block_time = BLOCK_TIME_ESTIMATE
+        self.ws_url = WS_RPC_URL
+        self.priority_fee_gwei = None
+        self.priority_fee_time = 0
+        self.market_cache = MarketDataCache()
+        self.config_tokens = tuple(registry.tokens)  # Набор токенов, под который заполнен market_cache
+        self.schedulers = {host: ProviderScheduler(host, calls_per_minute) for host, calls_per_minute in PROVIDER_RATE_LIMITS.items()}
+        self.coin_markets = CoinMarketsPlanner(self)
+        self.candles = CandleStore(lambda params: self.fetch_json(BINANCE_KLINES_URL, CACHE_TTL_BINANCE, params=params, stale_ttl=0))
+        self.generation = 0  # Растёт при каждой ротации соединений, потоки по нему переподключаются
+        self.quotes = {}  # (market, symbol) -> последний тикер из потока Binance
         self.last_price_data = None
         self.last_price_time = None
         self.price_cooldown = 10  # Секунд между запросами цены
         logger.info("Scanner initialized with AsyncWeb3")
 
     async def init_session(self):
-        """Initialize aiohttp ClientSession asynchronously"""
+        """Подключение к общей HTTP сессии процесса (http_client)"""
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            self.session = await http_client.get_session()
+            await self.rpc_pool.attach_session(self.session)
             logger.info("AIOHTTP session initialized")
         else:
             logger.debug("AIOHTTP session already initialized")
 
-    async def get_current_gas(self):
-        """Получение текущего значения газа через fee_history"""
+    async def reconnect(self):
+        """Горячая ротация соединений: новая HTTP сессия для REST и RPC, потоки переподключаются; кэши и котировки сохраняются"""
+        self.session = await http_client.rotate()
+        await self.rpc_pool.attach_session(self.session)
+        self.generation += 1
+        logger.info(f"Scanner connections rotated (generation {self.generation})")
+
+    def reload_config(self):
+        """Применение перечитанного списка токенов: символы потоков Binance обновятся при переподключении"""
+        BINANCE_STREAM_SYMBOLS["spot"] = registry.binance_symbols("l2")
+        tokens = tuple(registry.tokens)
+        if tokens != self.config_tokens:
+            # Ключи кэша содержат списки id и символов: записи под старый набор больше никто не запросит
+            self.market_cache.invalidate()
+            self.config_tokens = tokens
+            logger.info("Token set changed, market data cache cleared")
+
+    async def warmup(self):
+        """Прогрев соединений ко всем внешним API при старте"""
+        urls = RPC_URLS + list(BINANCE_TICKER_URLS.values()) + [COINGECKO_MARKETS_URL]
+        await http_client.warmup(urls)
+
+    def scheduler_stats(self):
+        """Состояние очередей запросов к провайдерам с лимитами"""
+        return [scheduler.stats() for scheduler in self.schedulers.values()]
+
+    def rpc_stats(self):
+        """Статистика задержек и ошибок по RPC узлам"""
+        return self.rpc_pool.stats()
+
+    def estimate_new_blocks(self):
+        """Сколько блоков вышло с прошлого опроса (по оценке времени блока)"""
+        if self.last_block_number is None:
+            return 1
+        elapsed = time.monotonic() - self.last_poll_time
+        return max(1, min(FEE_HISTORY_MAX_BLOCKS, math.ceil(elapsed / self.block_time) + 1))
+
+    async def fetch_gas_samples(self):
+        """Замеры газа по каждому новому блоку с прошлого опроса (для gas_bus); [] — новых блоков нет, None — ошибка"""
+        if self.session is None:
+            await self.init_session()
         try:
-            if not await self.web3.is_connected():
-                logger.error("Не удалось подключиться к Manta Pacific")
-                return None
-            block_count = 1
-            newest_block = "latest"
             reward_percentiles = [25, 50, 75]
-            fee_history = await self.web3.eth.fee_history(block_count, newest_block, reward_percentiles)
-            base_fee_per_gas = fee_history["baseFeePerGas"][-1]
-            base_fee_gwei = Decimal(base_fee_per_gas) / Decimal('1000000000')  # Преобразуем wei в Gwei
-            priority_fee_gwei = [Decimal(fee) / Decimal('1000000000') for fee in fee_history["reward"][0]]  # Преобразуем приоритетные комиссии в Gwei
-            max_fee_slow = base_fee_gwei + priority_fee_gwei[0]  # Используем 25-й перцентиль для "медленной" транзакции
-            logger.info(f"Current gas price: {max_fee_slow:.6f} Gwei (base: {base_fee_gwei:.6f}, priority: {priority_fee_gwei[0]:.6f})")
-            return max_fee_slow
+            calls = [
+                ("eth_blockNumber", []),
+                ("eth_feeHistory", [hex(self.estimate_new_blocks()), "latest", reward_percentiles]),
+                ("eth_chainId", [])
+            ]
+            try:
+                # Успешный ответ на batch служит и проверкой подключения
+                _, fee_history, chain_id = await self.rpc_pool.call(lambda endpoint: rpc_batch(self.session, endpoint.url, calls))
+            except Exception as e:
+                logger.error(f"Не удалось подключиться к Manta Pacific: {str(e)}")
+                return None
+            if int(chain_id, 16) != MANTA_CHAIN_ID:
+                logger.error(f"Неверный chainId от RPC: {int(chain_id, 16)}")
+                return None
+
+            histories = [fee_history]
+            oldest_block = int(fee_history["oldestBlock"], 16)
+            if self.last_block_number is not None and oldest_block > self.last_block_number + 1:
+                # Оценка оказалась мала — дозапрашиваем пропущенные блоки одним batch запросом
+                first_missing = max(self.last_block_number + 1, oldest_block - FEE_HISTORY_MAX_BLOCKS * FEE_HISTORY_BACKFILL_CHUNKS)
+                backfill_calls = []
+                newest = oldest_block - 1
+                while newest >= first_missing:
+                    count = min(FEE_HISTORY_MAX_BLOCKS, newest - first_missing + 1)
+                    backfill_calls.append(("eth_feeHistory", [hex(count), hex(newest), reward_percentiles]))
+                    newest -= count
+                try:
+                    backfill = await self.rpc_pool.call(lambda endpoint: rpc_batch(self.session, endpoint.url, backfill_calls))
+                    histories = list(reversed(backfill)) + histories
+                    logger.debug(f"Backfilled fee_history for blocks {first_missing}-{oldest_block - 1}")
+                except Exception as e:
+                    logger.warning(f"Не удалось дозапросить блоки {first_missing}-{oldest_block - 1}: {str(e)}")
+
+            samples = self.samples_from_fee_history(histories)
+            if not samples:
+                logger.debug(f"No blocks newer than {self.last_block_number}")
+                return []
+            now = time.monotonic()
+            if self.last_block_number is not None and samples[-1].block > self.last_block_number:
+                observed = (now - self.last_poll_time) / (samples[-1].block - self.last_block_number)
+                self.block_time = RPC_EWMA_ALPHA * observed + (1 - RPC_EWMA_ALPHA) * self.block_time
+            self.last_block_number = samples[-1].block
+            self.last_poll_time = now
+            logger.info(f"Current gas price: {samples[-1].value:.6f} Gwei (block {samples[-1].block}, {len(samples)} new blocks)")
+            return samples
         except Exception as e:
             logger.error(f"Ошибка при получении газа: {str(e)}")
             return None
 
+    def samples_from_fee_history(self, histories):
+        """Замеры по блокам из ответов eth_feeHistory, только блоки новее last_block_number"""
+        samples = []
+        entries = []
+        for history in histories:
+            oldest_block = int(history["oldestBlock"], 16)
+            for i, rewards in enumerate(history["reward"]):
+                entries.append((oldest_block + i, history["baseFeePerGas"][i], rewards))
+        if not entries:
+            return samples
+        newest_block = entries[-1][0]
+        now = time.time()
+        for block, base_fee_per_gas, rewards in entries:
+            if self.last_block_number is not None and block <= self.last_block_number:
+                continue
+            base_fee_gwei = Decimal(int(base_fee_per_gas, 16)) / GWEI  # Преобразуем wei в Gwei
+            priority_fee_gwei = Decimal(int(rewards[0], 16)) / GWEI  # 25-й перцентиль для "медленной" транзакции
+            timestamp = now - (newest_block - block) * self.block_time
+            samples.append(GasSample(timestamp, base_fee_gwei + priority_fee_gwei, block))
+        return samples
+
+    async def fetch_json(self, url, ttl, params=None, headers=None, timeout=UPSTREAM_TIMEOUT, priority=PRIORITY_USER, stale_ttl=None):
+        """GET запрос к внешнему API через общий кэш с дедлайном, возвращает (status, data); status None при таймауте или ошибке сети.
+        Запросы к провайдерам из PROVIDER_RATE_LIMITS идут через их очередь с учётом priority.
+        stale_ttl=0 — для фоновых обновлений со своим расписанием: устаревшая запись не отдаётся, ждём свежий ответ"""
+        key = url if not params else f"{url}?{urlencode(sorted(params.items()))}"
+
+        async def request():
+            async with self.session.get(url, params=params, headers=headers) as resp:
+                if resp.status != 200:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise UpstreamError(resp.status, int(retry_after) if retry_after and retry_after.isdigit() else None)
+                return await resp.json()
+
+        scheduler = self.schedulers.get(urlparse(url).hostname)
+
+        async def fetch():
+            if scheduler is None:
+                return await request()
+            return await scheduler.submit(request, priority)
+
+        try:
+            # Кэш защищает запрос через shield: по таймауту он продолжится в фоне и заполнит кэш
+            return 200, await asyncio.wait_for(self.market_cache.get(key, fetch, ttl, stale_ttl), timeout)
+        except UpstreamError as e:
+            return e.status, None
+        except asyncio.TimeoutError:
+            logger.warning(f"Таймаут запроса {url} ({timeout}s)")
+            return None, None
+        except (aiohttp.ClientError, ValueError) as e:
+            # Ошибка соединения или неразборчивый JSON — как и таймаут, не должна ронять соседние запросы в gather
+            logger.warning(f"Ошибка запроса {url}: {str(e)}")
+            return None, None
+
+    def get_quote(self, market, symbol):
+        """Свежая котировка из потока Binance или None"""
+        quote = self.quotes.get((market, symbol))
+        if quote is None or time.time() - quote['time'] > BINANCE_QUOTE_MAX_AGE:
+            return None
+        return quote
+
+    async def binance_ticker(self, market, symbol):
+        """24h тикер Binance: из таблицы котировок, если он свежий, иначе общим запросом за все символы; возвращает (status, data)"""
+        quote = self.get_quote(market, symbol)
+        if quote is not None:
+            return 200, quote
+        symbols = BINANCE_STREAM_SYMBOLS[market]
+        status = await self.refresh_binance_tickers(market, symbols if symbol in symbols else symbols + [symbol])
+        quote = self.quotes.get((market, symbol))
+        if status == 200 and quote is not None:
+            return 200, quote
+        # Например, неизвестный символ ломает весь bulk запрос — пробуем одиночный
+        return await self.fetch_json(BINANCE_TICKER_URLS[market], CACHE_TTL_BINANCE, params={"symbol": symbol})
+
+    async def refresh_binance_tickers(self, market, symbols=None):
+        """Тикеры всех символов рынка одним запросом, результаты попадают в таблицу котировок; возвращает status"""
+        symbols = sorted(set(symbols or BINANCE_STREAM_SYMBOLS[market]))
+        if market == "spot":
+            params = {"symbols": json.dumps(symbols, separators=(',', ':'))}
+        else:
+            params = None  # Фьючерсный API не принимает symbols — берём все тикеры и фильтруем
+        status, data = await self.fetch_json(BINANCE_TICKER_URLS[market], CACHE_TTL_BINANCE, params=params)
+        if status != 200:
+            logger.warning(f"Binance {market} bulk ticker вернул ошибку: {status}")
+            return status
+        wanted = set(symbols)
+        for ticker in data:
+            if ticker['symbol'] in wanted:
+                current = self.quotes.get((market, ticker['symbol']))
+                if current is not None and current['time'] > ticker['closeTime'] / 1000:
+                    continue  # Котировка из потока новее ответа REST (например, взятого из кэша)
+                self.quotes[(market, ticker['symbol'])] = {
+                    'lastPrice': ticker['lastPrice'],
+                    'priceChangePercent': ticker['priceChangePercent'],
+                    'quoteVolume': ticker['quoteVolume'],
+                    'time': ticker['closeTime'] / 1000
+                }
+        logger.debug(f"Binance {market} tickers refreshed for {len(wanted)} symbols")
+        return status
+
+    def apply_ticker(self, market, ticker):
+        """Обновление таблицы котировок по событию 24hrTicker/24hrMiniTicker"""
+        symbol = ticker['s']
+        quote = {
+            'lastPrice': ticker['c'],
+            'quoteVolume': ticker['q'],
+            'time': ticker['E'] / 1000 if 'E' in ticker else time.time()
+        }
+        if 'P' in ticker:
+            quote['priceChangePercent'] = ticker['P']
+        else:
+            # В miniTicker нет процента изменения — считаем по цене открытия
+            open_price = Decimal(ticker['o'])
+            quote['priceChangePercent'] = str((Decimal(ticker['c']) - open_price) / open_price * 100) if open_price else '0'
+        self.quotes[(market, symbol)] = quote
+
+    async def resync_quotes(self, market):
+        """Заполнение таблицы котировок через REST после (пере)подключения"""
+        await self.refresh_binance_tickers(market)
+
+    async def stream_tickers(self, market):
+        """Поток @ticker Binance для рынка (spot/futures) с переподключением и синхронизацией через REST"""
+        if self.session is None:
+            await self.init_session()
+        backoff = WS_RECONNECT_MIN
+        while True:
+            try:
+                streams = "/".join(f"{symbol.lower()}@ticker" for symbol in BINANCE_STREAM_SYMBOLS[market])
+                url = BINANCE_STREAM_URLS[market] + streams
+                generation = self.generation
+                await self.resync_quotes(market)
+                async with self.session.ws_connect(url, heartbeat=BINANCE_WS_HEARTBEAT) as ws:
+                    logger.info(f"Binance {market} ticker stream connected")
+                    backoff = WS_RECONNECT_MIN
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            payload = msg.json()
+                            self.apply_ticker(market, payload.get('data', payload))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        if self.generation != generation:
+                            break
+                if self.generation != generation:
+                    logger.info(f"Binance {market} ticker stream reconnecting after connection rotation")
+                    continue  # Без паузы
+                logger.warning(f"Binance {market} ticker stream closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка потока тикеров Binance {market}: {str(e)}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+
+    async def stream_market_data(self):
+        """Потоки тикеров Binance для спота и фьючерсов"""
+        await asyncio.gather(*(self.stream_tickers(market) for market in BINANCE_STREAM_URLS))
+
     async def get_manta_price_and_changes(self):
-        """Получение текущей цены MANTA/USDT и изменений"""
+        """Получение текущей цены MANTA/USDT и изменений (запросы идут параллельно, недоступные части — None)"""
         if self.session is None:
             logger.error("AIOHTTP session not initialized")
             return None, None, None, None, None, None, None
         try:
-            async with self.session.get(BINANCE_API_URL) as binance_resp:
-                if binance_resp.status != 200:
-                    logger.error(f"Binance API вернул ошибку: {binance_resp.status}")
-                    return None, None, None, None, None, None, None
-                binance_data = await binance_resp.json()
+            ticker_result, metrics = await asyncio.gather(
+                self.binance_ticker("spot", "MANTAUSDT"),
+                self.candles.get_metrics("MANTAUSDT"),
+                return_exceptions=True
+            )
+            if isinstance(ticker_result, BaseException):
+                logger.error(f"Ошибка тикера Binance для MANTAUSDT: {ticker_result}")
+                ticker_result = (None, None)
+            binance_status, binance_data = ticker_result
+            if isinstance(metrics, BaseException):
+                logger.error(f"Ошибка дневных свечей для MANTAUSDT: {metrics}")
+                metrics = None
+
+            price = price_change_24h = None
+            if binance_status == 200:
                 price = Decimal(binance_data['lastPrice'])
                 price_change_24h = Decimal(binance_data['priceChangePercent'])
+            else:
+                logger.error(f"Binance API вернул ошибку: {binance_status}")
+
+            price_change_7d = price_change_30d = price_change_all = ath = atl = None
+            if metrics is not None:
+                price_change_7d = metrics['change_7d']
+                price_change_30d = metrics['change_30d']
+                price_change_all = metrics['change_all']
+                ath = metrics['ath']
+                atl = metrics['atl']
+            else:
+                logger.error("Нет дневных свечей для MANTAUSDT")
 
-            async with self.session.get(COINGECKO_API_URL_30D) as coingecko_30d_resp:
-                if coingecko_30d_resp.status == 429:
-                    logger.error("Превышен лимит запросов CoinGecko (30 дней)")
-                    return None, None, None, None, None, None, None
-                if coingecko_30d_resp.status != 200:
-                    logger.error(f"CoinGecko 30d API вернул ошибку: {coingecko_30d_resp.status}")
-                    return price, price_change_24h, None, None, None, None, None
-                coingecko_30d_data = await coingecko_30d_resp.json()
-                prices_30d = coingecko_30d_data['prices']
-                current_price = Decimal(str(prices_30d[-1][1]))
-                price_7d_ago = Decimal(str(prices_30d[-8][1])) if len(prices_30d) >= 8 else current_price
-                price_30d_ago = Decimal(str(prices_30d[0][1])) if prices_30d else current_price
-                price_change_7d = ((current_price - price_7d_ago) / price_7d_ago * 100) if price_7d_ago != 0 else Decimal('0')
-                price_change_30d = ((current_price - price_30d_ago) / price_30d_ago * 100) if price_30d_ago != 0 else Decimal('0')
-
-            async with self.session.get(COINGECKO_API_URL_ALL) as coingecko_all_resp:
-                if coingecko_all_resp.status == 429:
-                    logger.error("Превышен лимит запросов CoinGecko (все время)")
-                    return None, None, None, None, None, None, None
-                if coingecko_all_resp.status != 200:
-                    logger.error(f"CoinGecko all time API вернул ошибку: {coingecko_all_resp.status}")
-                    return price, price_change_24h, price_change_7d, price_change_30d, None, None, None
-                coingecko_all_data = await coingecko_all_resp.json()
-                ath_price = Decimal(str(coingecko_all_data['market_data']['ath']['usd']))
-                ath_date = datetime.strptime(coingecko_all_data['market_data']['ath_date']['usd'], "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
-                atl_price = Decimal(str(coingecko_all_data['market_data']['atl']['usd']))
-                atl_date = datetime.strptime(coingecko_all_data['market_data']['atl_date']['usd'], "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
-                price_change_all = ((current_price - ath_price) / ath_price * 100) if ath_price != 0 else Decimal('0')
-
-                logger.info(f"Цена MANTA/USDT: {price}, 24ч: {price_change_24h}%, 7д: {price_change_7d}%, 30д: {price_change_30d}%, Все время: {price_change_all}%, ATH: {ath_price} ({ath_date}), ATL: {atl_price} ({atl_date})")
-                return price, price_change_24h, price_change_7d, price_change_30d, price_change_all, (ath_price, ath_date), (atl_price, atl_date)
+            logger.info(f"Цена MANTA/USDT: {price}, 24ч: {price_change_24h}%, 7д: {price_change_7d}%, 30д: {price_change_30d}%, Все время: {price_change_all}%, ATH: {ath}, ATL: {atl}")
+            return price, price_change_24h, price_change_7d, price_change_30d, price_change_all, ath, atl
 
         except Exception as e:
             logger.error(f"Ошибка при получении цены Manta: {str(e)}")
@@ -112,72 +731,53 @@ class Scanner:
             logger.error("AIOHTTP session not initialized")
             return None
         try:
-            url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={ticker}"
-            async with self.session.get(url) as resp:
-                if resp.status != 200:
-                    logger.error(f"Binance API вернул ошибку для {ticker}: {resp.status}")
-                    return None
-                data = await resp.json()
-                price = Decimal(data['lastPrice'])
-                logger.info(f"Цена {ticker}: {price}")
-                return price
+            status, data = await self.binance_ticker("spot", ticker)
+            if status != 200:
+                logger.error(f"Binance API вернул ошибку для {ticker}: {status}")
+                return None
+            price = Decimal(data['lastPrice'])
+            logger.info(f"Цена {ticker}: {price}")
+            return price
         except Exception as e:
             logger.error(f"Ошибка при получении цены {ticker}: {str(e)}")
             return None
 
     async def get_price_and_changes(self, ticker):
-        """Получение цены и изменений для любого токена"""
+        """Получение цены и изменений для любого токена (запросы идут параллельно, недоступные части — None)"""
         if self.session is None:
             logger.error("AIOHTTP session not initialized")
             return None, None, None, None, None
         try:
-            # Маппинг тикеров на ID CoinGecko
-            coingecko_ids = {
-                "MANTAUSDT": "manta-network",
-                "OPUSDT": "optimism",
-                "ARBUSDT": "arbitrum",
-                "STRKUSDT": "starknet",
-                "ZKUSDT": "zksync",
-                "SCRUSDT": "scroll"
-            }
-            coingecko_id = coingecko_ids.get(ticker, "")
-
-            async with self.session.get(f"https://api.binance.com/api/v3/ticker/24hr?symbol={ticker}") as binance_resp:
-                if binance_resp.status != 200:
-                    logger.error(f"Binance API вернул ошибку для {ticker}: {binance_resp.status}")
-                    return None, None, None, None, None
-                binance_data = await binance_resp.json()
+            ticker_result, metrics = await asyncio.gather(
+                self.binance_ticker("spot", ticker),
+                self.candles.get_metrics(ticker),
+                return_exceptions=True
+            )
+            if isinstance(ticker_result, BaseException):
+                logger.error(f"Ошибка тикера Binance для {ticker}: {ticker_result}")
+                ticker_result = (None, None)
+            binance_status, binance_data = ticker_result
+            if isinstance(metrics, BaseException):
+                logger.error(f"Ошибка дневных свечей для {ticker}: {metrics}")
+                metrics = None
+
+            price = price_change_24h = None
+            if binance_status == 200:
                 price = Decimal(binance_data['lastPrice'])
                 price_change_24h = Decimal(binance_data['priceChangePercent'])
+            else:
+                logger.error(f"Binance API вернул ошибку для {ticker}: {binance_status}")
+
+            price_change_7d = price_change_30d = price_change_all = None
+            if metrics is not None:
+                price_change_7d = metrics['change_7d']
+                price_change_30d = metrics['change_30d']
+                price_change_all = metrics['change_all']
+            else:
+                logger.error(f"Нет дневных свечей для {ticker}")
 
-            async with self.session.get(f"https://api.coingecko.com/api/v3/coins/{coingecko_id}/market_chart?vs_currency=usd&days=30&interval=daily") as coingecko_30d_resp:
-                if coingecko_30d_resp.status == 429:
-                    logger.error(f"Превышен лимит запросов CoinGecko (30 дней) для {ticker}")
-                    return price, price_change_24h, None, None, None
-                if coingecko_30d_resp.status != 200:
-                    logger.error(f"CoinGecko 30d API вернул ошибку для {ticker}: {coingecko_30d_resp.status}")
-                    return price, price_change_24h, None, None, None
-                coingecko_30d_data = await coingecko_30d_resp.json()
-                prices_30d = coingecko_30d_data['prices']
-                current_price = Decimal(str(prices_30d[-1][1]))
-                price_7d_ago = Decimal(str(prices_30d[-8][1])) if len(prices_30d) >= 8 else current_price
-                price_30d_ago = Decimal(str(prices_30d[0][1])) if prices_30d else current_price
-                price_change_7d = ((current_price - price_7d_ago) / price_7d_ago * 100) if price_7d_ago != 0 else Decimal('0')
-                price_change_30d = ((current_price - price_30d_ago) / price_30d_ago * 100) if price_30d_ago != 0 else Decimal('0')
-
-            async with self.session.get(f"https://api.coingecko.com/api/v3/coins/{coingecko_id}?localization=false&tickers=false&market_data=true") as coingecko_all_resp:
-                if coingecko_all_resp.status == 429:
-                    logger.error(f"Превышен лимит запросов CoinGecko (все время) для {ticker}")
-                    return price, price_change_24h, price_change_7d, price_change_30d, None
-                if coingecko_all_resp.status != 200:
-                    logger.error(f"CoinGecko all time API вернул ошибку для {ticker}: {coingecko_all_resp.status}")
-                    return price, price_change_24h, price_change_7d, price_change_30d, None
-                coingecko_all_data = await coingecko_all_resp.json()
-                ath_price = Decimal(str(coingecko_all_data['market_data']['ath']['usd']))
-                price_change_all = ((current_price - ath_price) / ath_price * 100) if ath_price != 0 else Decimal('0')
-
-                logger.info(f"Цена {ticker}: {price}, 24ч: {price_change_24h}%, 7д: {price_change_7d}%, 30д: {price_change_30d}%, Все время: {price_change_all}%")
-                return price, price_change_24h, price_change_7d, price_change_30d, price_change_all
+            logger.info(f"Цена {ticker}: {price}, 24ч: {price_change_24h}%, 7д: {price_change_7d}%, 30д: {price_change_30d}%, Все время: {price_change_all}%")
+            return price, price_change_24h, price_change_7d, price_change_30d, price_change_all
 
         except Exception as e:
             logger.error(f"Ошибка при получении данных для {ticker}: {str(e)}")
@@ -189,14 +789,13 @@ class Scanner:
             logger.error("AIOHTTP session not initialized")
             return None
         try:
-            async with self.session.get(BINANCE_API_URL) as resp:
-                if resp.status != 200:
-                    logger.error(f"Binance Spot API вернул ошибку: {resp.status}")
-                    return None
-                data = await resp.json()
-                volume = Decimal(data['quoteVolume'])
-                logger.info(f"24-часовой объем торгов MANTA/USDT на споте: {volume:.2f} USDT")
-                return volume
+            status, data = await self.binance_ticker("spot", "MANTAUSDT")
+            if status != 200:
+                logger.error(f"Binance Spot API вернул ошибку: {status}")
+                return None
+            volume = Decimal(data['quoteVolume'])
+            logger.info(f"24-часовой объем торгов MANTA/USDT на споте: {volume:.2f} USDT")
+            return volume
         except Exception as e:
             logger.error(f"Ошибка при получении объема спота MANTA: {str(e)}")
             return None
@@ -207,37 +806,96 @@ class Scanner:
             logger.error("AIOHTTP session not initialized")
             return None
         try:
-            async with self.session.get(BINANCE_FUTURES_API_URL) as resp:
-                if resp.status != 200:
-                    logger.error(f"Binance Futures API вернул ошибку: {resp.status}")
-                    return None
-                data = await resp.json()
-                volume = Decimal(data['quoteVolume'])
-                logger.info(f"24-часовой объем торгов MANTA/USDT на фьючерсах: {volume:.2f} USDT")
-                return volume
+            status, data = await self.binance_ticker("futures", "MANTAUSDT")
+            if status != 200:
+                logger.error(f"Binance Futures API вернул ошибку: {status}")
+                return None
+            volume = Decimal(data['quoteVolume'])
+            logger.info(f"24-часовой объем торгов MANTA/USDT на фьючерсах: {volume:.2f} USDT")
+            return volume
         except Exception as e:
             logger.error(f"Ошибка при получении объема фьючерсов MANTA: {str(e)}")
             return None
 
-    async def monitor_gas(self, interval, callback):
-        """Мониторинг газа с вызовом callback для передачи данных"""
+    async def stream_gas(self, interval):
+        """Поток газа по новым блокам (WebSocket newHeads), при обрыве соединения — HTTP опрос с интервалом interval"""
         if self.session is None:
-            await self.init_session()  # Ensure session is initialized
+            await self.init_session()
+        backoff = WS_RECONNECT_MIN
         while True:
-            logger.info("Starting gas value check...")
-            gas_value = await self.get_current_gas()
-            if gas_value is not None:
-                await callback(gas_value)
-            await asyncio.sleep(interval)
+            try:
+                heads = await self.consume_new_heads()
+                if heads:
+                    backoff = WS_RECONNECT_MIN
+                logger.warning(f"WebSocket stream closed after {heads} blocks")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка WebSocket потока газа: {str(e)}")
+            logger.info(f"Falling back to HTTP gas polling for {backoff}s")
+            deadline = time.monotonic() + backoff
+            while True:
+                await self.gas_bus.sample()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(interval, remaining))
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+
+    async def consume_new_heads(self):
+        """Подписка на newHeads и публикация замера газа по каждому блоку, возвращает число обработанных блоков"""
+        heads = 0
+        generation = self.generation
+        # Свои повторы подключения у провайдера отключены: паузы между попытками ведёт stream_gas, а пока их нет — опрашивает HTTP
+        async with AsyncWeb3(WebSocketProvider(self.ws_url, max_connection_retries=1)) as w3:
+            await w3.eth.subscribe("newHeads")
+            logger.info(f"Subscribed to newHeads at {self.ws_url}")
+            subscription = w3.socket.process_subscriptions().__aiter__()
+            while True:
+                try:
+                    response = await asyncio.wait_for(subscription.__anext__(), WS_HEAD_TIMEOUT)
+                except StopAsyncIteration:
+                    return heads
+                except asyncio.TimeoutError:
+                    logger.warning(f"No new blocks for {WS_HEAD_TIMEOUT}s, reconnecting")
+                    return heads
+                sample = await self.sample_from_header(w3, response["result"])
+                if sample is not None:
+                    self.gas_bus.publish(sample)
+                    heads += 1
+                if self.generation != generation:
+                    logger.info("Reconnecting newHeads stream after connection rotation")
+                    return heads
+
+    async def sample_from_header(self, w3, header):
+        """Замер газа по заголовку блока: base fee из заголовка + 25-й перцентиль приоритетной комиссии; None для уже опубликованного блока"""
+        base_fee_per_gas = header.get("baseFeePerGas")
+        if base_fee_per_gas is None:
+            return None
+        block_number = header["number"]
+        if isinstance(block_number, str):
+            block_number = int(block_number, 16)
+        if isinstance(base_fee_per_gas, str):
+            base_fee_per_gas = int(base_fee_per_gas, 16)
+        if self.priority_fee_gwei is None or time.monotonic() - self.priority_fee_time >= WS_PRIORITY_FEE_TTL:
+            fee_history = await w3.eth.fee_history(1, block_number, [25, 50, 75])
+            self.priority_fee_gwei = Decimal(fee_history["reward"][0][0]) / GWEI
+            self.priority_fee_time = time.monotonic()
+        # Проверка после await: пока шёл запрос, HTTP опрос (например, по кнопке) мог опубликовать этот блок — повтор посчитался бы дважды
+        if self.last_block_number is not None and block_number <= self.last_block_number:
+            logger.debug(f"Skipping already published block {block_number} (last {self.last_block_number})")
+            return None
+        base_fee_gwei = Decimal(base_fee_per_gas) / GWEI
+        max_fee_slow = base_fee_gwei + self.priority_fee_gwei
+        self.last_block_number = block_number
+        self.last_poll_time = time.monotonic()
+        logger.debug(f"Block {block_number}: gas {max_fee_slow:.6f} Gwei (base: {base_fee_gwei:.6f}, priority: {self.priority_fee_gwei:.6f})")
+        return GasSample(time.time(), max_fee_slow, block_number)
 
     async def close(self):
-        """Закрытие соединений"""
+        """Отключение от общей HTTP сессии (саму сессию закрывает http_client.close())"""
         try:
-            if hasattr(self.web3.provider, 'session') and self.web3.provider.session is not None:
-                await self.web3.provider.session.close()
-                logger.info("Web3 session closed")
-            if self.session is not None and not self.session.closed:
-                await self.session.close()
-                logger.info("AIOHTTP session closed")
+            self.session = None
+            logger.info("Scanner detached from shared HTTP session")
         except Exception as e:
             logger.error(f"Error closing sessions: {str(e)}")
\ No newline at end of file
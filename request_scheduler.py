@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Константы
+PRIORITY_USER = 0  # Запрос по нажатию кнопки
+PRIORITY_BACKGROUND = 1  # Фоновое обновление кэша
+RATE_LIMIT_BURST = 5  # Сколько запросов можно отправить подряд без ожидания
+RATE_LIMIT_MAX_RETRIES = 3  # Повторов после 429
+RATE_LIMIT_DEFAULT_BACKOFF = 15  # Пауза после 429 без Retry-After, сек (удваивается с каждым повтором)
+
+class ProviderScheduler:
+    """Очередь запросов к одному провайдеру: token bucket, приоритеты, Retry-After и повторы после 429"""
+    def __init__(self, name, calls_per_minute, burst=RATE_LIMIT_BURST, max_retries=RATE_LIMIT_MAX_RETRIES):
+        self.name = name
+        self.rate = calls_per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.max_retries = max_retries
+        self.queue = []  # (priority, seq, request, future, attempt)
+        self.counter = itertools.count()
+        self.worker = None
+        self.sent = 0
+        self.rejected = 0
+
+    async def submit(self, request, priority=PRIORITY_USER):
+        """Выполнение request() в порядке приоритета и в пределах бюджета провайдера"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(request, future, priority, 0)
+        return await future
+
+    def _enqueue(self, request, future, priority, attempt, seq=None):
+        seq = next(self.counter) if seq is None else seq  # Повтор сохраняет своё место в очереди
+        heapq.heappush(self.queue, (priority, seq, request, future, attempt))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self._run())
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _run(self):
+        while self.queue:
+            # Ожидающий, ушедший по таймауту, запрос не отменяет: кэш дождётся ответа через shield
+            self._refill()
+            wait = self.blocked_until - time.monotonic()
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            priority, seq, request, future, attempt = heapq.heappop(self.queue)
+            self.tokens -= 1
+            self.sent += 1
+            asyncio.ensure_future(self._execute(request, future, priority, attempt, seq))
+
+    async def _execute(self, request, future, priority, attempt, seq):
+        try:
+            result = await request()
+        except Exception as e:
+            if getattr(e, 'status', None) == 429:
+                self.rejected += 1
+                retry_after = getattr(e, 'retry_after', None) or RATE_LIMIT_DEFAULT_BACKOFF * 2 ** attempt
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                self.tokens = 0.0
+                logger.warning(f"{self.name} rate limited, pausing for {retry_after}s (attempt {attempt + 1})")
+                if attempt < self.max_retries and not future.done():
+                    self._enqueue(request, future, priority, attempt + 1, seq)
+                    return
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        self._refill()
+        return {
+            "provider": self.name,
+            "queued": len(self.queue),
+            "tokens": round(self.tokens, 2),
+            "blocked_for": max(0, round(self.blocked_until - time.monotonic(), 1)),
+            "sent": self.sent,
+            "rejected": self.rejected
+        }
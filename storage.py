@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import asyncpg
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Константы
+DATABASE_URL = os.getenv("DATABASE_URL")
+STORAGE_POOL_MIN = 1  # Минимум соединений в пуле
+STORAGE_POOL_MAX = 5  # Максимум соединений в пуле
+STORAGE_FLUSH_INTERVAL = 5  # Как часто сбрасывать накопленные изменения в базу, сек
+STORAGE_COPY_THRESHOLD = 500  # С какого числа строк статистики писать через COPY вместо executemany
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_levels (
+    user_id BIGINT PRIMARY KEY,
+    levels NUMERIC[] NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id BIGINT PRIMARY KEY,
+    silent_start TIME,
+    silent_end TIME
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    action TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day, action)
+);
+CREATE TABLE IF NOT EXISTS fear_greed (
+    day_start BIGINT PRIMARY KEY,
+    value SMALLINT NOT NULL,
+    category TEXT NOT NULL
+);
+"""
+
+UPSERT_LEVELS = """
+INSERT INTO user_levels (user_id, levels) VALUES ($1, $2)
+ON CONFLICT (user_id) DO UPDATE SET levels = EXCLUDED.levels
+"""
+UPSERT_SETTINGS = """
+INSERT INTO user_settings (user_id, silent_start, silent_end) VALUES ($1, $2, $3)
+ON CONFLICT (user_id) DO UPDATE SET silent_start = EXCLUDED.silent_start, silent_end = EXCLUDED.silent_end
+"""
+UPSERT_STATS = """
+INSERT INTO user_stats (user_id, day, action, count) VALUES ($1, $2, $3, $4)
+ON CONFLICT (user_id, day, action) DO UPDATE SET count = EXCLUDED.count
+"""
+UPSERT_FEAR_GREED = """
+INSERT INTO fear_greed (day_start, value, category) VALUES ($1, $2, $3)
+ON CONFLICT (day_start) DO UPDATE SET value = EXCLUDED.value, category = EXCLUDED.category
+"""
+MERGE_STATS_FROM_COPY = """
+INSERT INTO user_stats (user_id, day, action, count) SELECT user_id, day, action, count FROM user_stats_incoming
+ON CONFLICT (user_id, day, action) DO UPDATE SET count = EXCLUDED.count
+"""
+
+class Storage:
+    """Хранилище состояния пользователей в PostgreSQL: загрузка всего при старте и отложенная пакетная запись"""
+    def __init__(self, dsn=DATABASE_URL):
+        self.dsn = dsn
+        self.pool = None
+        # Изменения, ещё не записанные в базу; повторная запись того же ключа заменяет предыдущую
+        self.pending_levels = {}  # user_id -> levels
+        self.pending_settings = {}  # user_id -> (silent_start, silent_end)
+        self.pending_stats = {}  # (user_id, day, action) -> count
+        self.pending_fear_greed = {}  # day_start -> (value, category)
+        self.lock = asyncio.Lock()
+
+    @property
+    def enabled(self):
+        return self.pool is not None
+
+    async def connect(self):
+        if self.pool is not None:
+            return
+        if not self.dsn:
+            logger.warning("DATABASE_URL not set, user state will not be persisted")
+            return
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=STORAGE_POOL_MIN, max_size=STORAGE_POOL_MAX)
+        async with self.pool.acquire() as conn:
+            await conn.execute(SCHEMA)
+        logger.info("PostgreSQL storage connected")
+
+    async def load_all(self):
+        """Всё состояние одним запросом на таблицу: (levels, silent_hours, stats, fear_greed).
+        fear_greed — список (day_start, value, category) по возрастанию времени"""
+        levels, silent_hours, stats, fear_greed = {}, {}, {}, []
+        if not self.enabled:
+            return levels, silent_hours, stats, fear_greed
+        async with self.pool.acquire() as conn:
+            for row in await conn.fetch("SELECT user_id, levels FROM user_levels"):
+                levels[row['user_id']] = list(row['levels'])
+            for row in await conn.fetch("SELECT user_id, silent_start, silent_end FROM user_settings"):
+                silent_hours[row['user_id']] = (row['silent_start'], row['silent_end'])
+            for row in await conn.fetch("SELECT user_id, day, action, count FROM user_stats"):
+                stats.setdefault(row['user_id'], {}).setdefault(row['day'].isoformat(), {})[row['action']] = row['count']
+            for row in await conn.fetch("SELECT day_start, value, category FROM fear_greed ORDER BY day_start"):
+                fear_greed.append((row['day_start'], row['value'], row['category']))
+        logger.info(f"Loaded state from PostgreSQL: {len(levels)} level sets, {len(silent_hours)} settings, {len(stats)} users with stats, {len(fear_greed)} Fear & Greed points")
+        return levels, silent_hours, stats, fear_greed
+
+    def queue_levels(self, user_id, levels):
+        if self.enabled:
+            self.pending_levels[user_id] = list(levels)
+
+    def queue_silent_hours(self, user_id, silent_hours):
+        if self.enabled:
+            self.pending_settings[user_id] = tuple(silent_hours)
+
+    def queue_stats(self, user_id, day, counts):
+        """day — дата в ISO формате, counts — {действие: счётчик за день}"""
+        if self.enabled:
+            for action, count in counts.items():
+                self.pending_stats[(user_id, day, action)] = count
+
+    def queue_fear_greed(self, points):
+        """points — (day_start, value, category); точка за тот же день заменяет прежнюю"""
+        if self.enabled:
+            for day_start, value, category in points:
+                self.pending_fear_greed[day_start] = (value, category)
+
+    async def flush(self):
+        """Запись накопленных изменений пакетами; при ошибке они возвращаются в очередь"""
+        if not self.enabled:
+            return
+        async with self.lock:
+            levels, self.pending_levels = self.pending_levels, {}
+            settings, self.pending_settings = self.pending_settings, {}
+            stats, self.pending_stats = self.pending_stats, {}
+            fear_greed, self.pending_fear_greed = self.pending_fear_greed, {}
+            if not (levels or settings or stats or fear_greed):
+                return
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        if levels:
+                            await conn.executemany(UPSERT_LEVELS, list(levels.items()))
+                        if settings:
+                            await conn.executemany(UPSERT_SETTINGS, [(user_id, start, end) for user_id, (start, end) in settings.items()])
+                        if stats:
+                            await self._write_stats(conn, stats)
+                        if fear_greed:
+                            await conn.executemany(UPSERT_FEAR_GREED, [(day_start, value, category) for day_start, (value, category) in fear_greed.items()])
+                logger.debug(f"Flushed to PostgreSQL: {len(levels)} levels, {len(settings)} settings, {len(stats)} stats rows, {len(fear_greed)} Fear & Greed points")
+            except Exception as e:
+                # Более новые изменения, пришедшие во время записи, важнее возвращаемых
+                self.pending_levels = {**levels, **self.pending_levels}
+                self.pending_settings = {**settings, **self.pending_settings}
+                self.pending_stats = {**stats, **self.pending_stats}
+                self.pending_fear_greed = {**fear_greed, **self.pending_fear_greed}
+                logger.error(f"Error flushing state to PostgreSQL: {str(e)}")
+
+    @staticmethod
+    async def _write_stats(conn, stats):
+        records = [(user_id, date.fromisoformat(day), action, count) for (user_id, day, action), count in stats.items()]
+        if len(records) < STORAGE_COPY_THRESHOLD:
+            await conn.executemany(UPSERT_STATS, records)
+            return
+        await conn.execute("CREATE TEMP TABLE IF NOT EXISTS user_stats_incoming (LIKE user_stats INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        await conn.copy_records_to_table("user_stats_incoming", records=records, columns=["user_id", "day", "action", "count"])
+        await conn.execute(MERGE_STATS_FROM_COPY)
+
+    async def run_flusher(self, interval=STORAGE_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in storage flusher: {str(e)}")
+
+    async def close(self):
+        if self.pool is None:
+            return
+        await self.flush()
+        await self.pool.close()
+        self.pool = None
+        logger.info("PostgreSQL storage closed")
+
+storage = Storage()
@@ -1,13 +1,22 @@
 import asyncio
+import functools
 import logging
 import os
+import time as time_module
 from decimal import Decimal
-from datetime import datetime, time
-import aiohttp
+from datetime import date, datetime, time, timedelta
 import pytz
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramBadRequest, TelegramNotFound, TelegramRetryAfter
 from aiogram.filters import Command
 from monitoring_scanner import Scanner
+from token_registry import registry
+from storage import storage
+from usage_stats import UsageStats
+from level_index import LevelIndex, LevelAlertIndex
+from telegram_dispatcher import OutboundDispatcher, PRIORITY_ALERT, PRIORITY_REPLY
+from confirmation_scheduler import ConfirmationScheduler, PendingConfirmation
+from fear_greed import FearGreedHistory, FearGreedPoint, points_from_response, FEAR_GREED_URL, FEAR_GREED_BACKFILL_LIMIT
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,7 +35,33 @@ ADMIN_ID = 501156257
 INTERVAL = 60
 CONFIRMATION_INTERVAL = 20
 CONFIRMATION_COUNT = 3
+CONFIRMATION_BLOCKS = 10  # Пересечение подтверждается по стольким блокам после обнаружившего его замера...
+CONFIRMATION_WINDOW = (CONFIRMATION_COUNT - 1) * CONFIRMATION_INTERVAL  # ...или по замерам за это время, что наступит раньше
+CONFIRMATION_MIN_VALUES = 2  # Минимум замеров (включая первый) для подтверждения
+GAS_SAMPLE_MAX_AGE = 10  # Секунд, в течение которых замер газа из шины считается свежим
+GAS_SUMMARY_WINDOW = 86400  # За какой период показывать мин/медиану/макс газа в ответе "Газ", сек
 RESTART_TIMES = ["21:00"]
+# Метрики сравнения L2: ключ в l2_data_cache и заголовок раздела
+L2_METRICS = [("24h", "24 часа"), ("7d", "7 дней"), ("30d", "месяц"), ("all", "все время")]
+
+# Фрагменты описаний ошибок Telegram, означающих, что редактировать больше нечего
+MESSAGE_GONE_ERRORS = ("message to edit not found", "message can't be edited", "message_id_invalid")
+
+def classify_telegram_error(error):
+    """Тип ошибки редактирования: not_modified, gone (сообщения больше нет), retry (flood wait) или other"""
+    if isinstance(error, TelegramRetryAfter):
+        return "retry"
+    description = str(error).lower()
+    if isinstance(error, TelegramBadRequest) and "message is not modified" in description:
+        return "not_modified"
+    if isinstance(error, TelegramNotFound) or (isinstance(error, TelegramBadRequest) and any(text in description for text in MESSAGE_GONE_ERRORS)):
+        return "gone"
+    return "other"
+
+def log_alert_failure(chat_id, future):
+    """Колбэк доставки уведомления: ошибку некому вернуть, поэтому она только логируется"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Failed to deliver alert to chat_id={chat_id}: {future.exception()}")
 
 def is_silent_hour(user_id, now_kyiv):
     start_time, end_time = state.user_states.get(user_id, {}).get('silent_hours', (None, None))
@@ -46,53 +81,75 @@ class BotState:
         self.user_states = {}
         self.pending_commands = {}
         self.message_ids = {}
+        self.rendered = {}  # chat_id -> (хэш текста, хэш клавиатуры) последнего показанного сообщения
         self.l2_data_cache = None
         self.l2_data_time = None
         self.fear_greed_cache = None
         self.fear_greed_time = None
         self.fear_greed_cooldown = 300
+        self.fear_greed_history = FearGreedHistory()
         self.converter_cache = None
         self.converter_cache_time = None
-        self.user_stats = {}
+        self.usage_stats = UsageStats()
+        self.level_alerts = LevelAlertIndex()  # Интервалы без пересечений всех пользователей
+        self.unanchored = set()  # Пользователи без prev_level: получат его со следующим замером
+        self.confirmations = ConfirmationScheduler()  # Все незавершённые подтверждения пересечений
+        self.dispatcher = OutboundDispatcher(self.deliver_message)  # Исходящие сообщения с учётом лимитов Telegram
         self.is_first_run = True
         self.price_fetch_interval = 300
+        self.l2_rankings = {}  # метрика -> имена токенов по убыванию
+        self.register_market_consumers()
         logger.info("BotState initialized")
 
-    async def init_user_state(self, user_id):
+    def register_market_consumers(self):
+        self.scanner.coin_markets.register("converter", registry.coingecko_ids("converter"), self.update_converter_cache)
+        self.scanner.coin_markets.register("l2", registry.coingecko_ids("l2"), self.update_l2_cache)
+
+    async def hot_reload(self):
+        """Ежедневный перезапуск на месте: новые соединения и конфиг, кэши, сообщения, диалоги и состояние уведомлений сохраняются"""
+        self.usage_stats.flush()
+        for user_id, user_state in self.user_states.items():
+            storage.queue_levels(user_id, user_state['current_levels'])
+        await storage.flush()
+        try:
+            registry.reload()
+            self.scanner.reload_config()
+            self.register_market_consumers()
+        except Exception as e:
+            logger.error(f"Error reloading token config, keeping previous: {str(e)}")
+        await self.scanner.reconnect()
+        await self.set_menu_button()
+
+    async def load_state(self):
+        """Загрузка сохранённых уровней и тихих часов пользователей из ALLOWED_USERS, статистики всех пользователей и истории индекса страха и жадности.
+        Удалённые из ALLOWED_USERS остаются в базе, но не получают ни газ, ни уведомления"""
+        levels, silent_hours, stats, fear_greed = await storage.load_all()
+        for user_id, _ in ALLOWED_USERS:
+            await self.init_user_state(user_id, levels.get(user_id), silent_hours.get(user_id, (None, None)))
+        skipped = (levels.keys() | silent_hours.keys()) - set(self.user_states)
+        if skipped:
+            logger.info(f"Skipping stored state of users not in ALLOWED_USERS: {sorted(skipped)}")
+        self.usage_stats.load(stats)
+        self.fear_greed_history.load([FearGreedPoint(*row) for row in fear_greed])
+
+    async def init_user_state(self, user_id, levels=None, silent_hours=(None, None)):
         if user_id not in self.user_states:
             self.user_states[user_id] = {
                 'prev_level': None,
                 'last_measured_gas': None,
-                'current_levels': [],
+                'current_levels': list(levels or []),
+                'level_index': LevelIndex(),
                 'active_level': None,
-                'confirmation_states': {},
                 'notified_levels': set(),
-                'silent_hours': (None, None)
+                'silent_hours': silent_hours
             }
+            self.unanchored.add(user_id)
             await self.load_or_set_default_levels(user_id)
             if not self.user_states[user_id]['current_levels']:
                 logger.warning(f"current_levels is empty for user_id={user_id}, forcing default levels")
                 await self.load_or_set_default_levels(user_id)
             logger.debug(f"Initialized user_state for user_id={user_id}, current_levels={self.user_states[user_id]['current_levels']}, silent_hours={self.user_states[user_id]['silent_hours']}")
 
-    def init_user_stats(self, user_id):
-        if user_id not in self.user_stats:
-            self.user_stats[user_id] = {}
-        today = datetime.now(pytz.timezone('Europe/Kyiv')).date().isoformat()
-        default_stats = {
-            "Газ": 0, "Manta Price": 0, "Сравнение L2": 0,
-            "Задать Уровни": 0, "Уведомления": 0, "Админ": 0, "Страх и Жадность": 0,
-            "Тихие Часы": 0, "Manta Конвертер": 0, "Газ Калькулятор": 0
-        }
-        if today not in self.user_stats[user_id]:
-            self.user_stats[user_id][today] = default_stats.copy()
-        else:
-            for key in default_stats:
-                if key not in self.user_stats[user_id][today]:
-                    self.user_stats[user_id][today][key] = 0
-        asyncio.create_task(self.save_user_stats(user_id))
-        logger.debug(f"Initialized user_stats for user_id={user_id}")
-
     async def check_access(self, message: types.Message):
         chat_id = message.chat.id
         logger.debug(f"Checking access for chat_id={chat_id}")
@@ -104,7 +161,6 @@ class BotState:
             logger.warning(f"Access denied for chat_id={chat_id}")
             return False
         await self.init_user_state(chat_id)
-        self.init_user_stats(chat_id)
         return True
 
     async def set_menu_button(self):
@@ -132,6 +188,8 @@ class BotState:
                 self.user_states[user_id]['current_levels'] = levels
                 logger.info(f"Default levels set for user_id={user_id}: {levels}")
             self.user_states[user_id]['current_levels'].sort(reverse=True)
+            self.user_states[user_id]['level_index'].update(self.user_states[user_id]['current_levels'])
+            self.reindex_alerts(user_id)
             logger.info(f"Loaded levels for user_id={user_id}: {self.user_states[user_id]['current_levels']}")
         except Exception as e:
             logger.error(f"Error loading levels for user_id={user_id}: {str(e)}, setting to default levels")
@@ -146,28 +204,55 @@ class BotState:
                 Decimal('0.000050')
             ]
             self.user_states[user_id]['current_levels'] = levels
+            self.user_states[user_id]['level_index'].update(levels)
+            self.reindex_alerts(user_id)
             logger.info(f"Set default levels due to error for user_id={user_id}: {self.user_states[user_id]['current_levels']}")
 
+    def set_anchor(self, user_id, value):
+        """Новое опорное значение prev_level: от него отсчитываются пересечения уровней"""
+        self.user_states[user_id]['prev_level'] = value
+        self.unanchored.discard(user_id)
+        self.reindex_alerts(user_id)
+
+    def reindex_alerts(self, user_id):
+        user_state = self.user_states[user_id]
+        if user_state['prev_level'] is None:
+            self.level_alerts.remove(user_id)
+            return
+        self.level_alerts.update(user_id, *user_state['level_index'].bounds(user_state['prev_level']))
+
+    def users_to_check(self, value):
+        """Пользователи, которых затрагивает замер: пересечён хотя бы один их уровень или ещё нет prev_level"""
+        return self.level_alerts.affected(value) | self.unanchored
+
     async def save_levels(self, user_id, levels):
         levels.sort(reverse=True)
         try:
             self.user_states[user_id]['current_levels'] = levels
+            self.user_states[user_id]['level_index'].update(levels)
+            self.reindex_alerts(user_id)
+            # Подтверждения удалённых уровней отменяются, иначе они закончатся уведомлением об уже несуществующем уровне
+            kept = set(levels)
+            for level in list(self.confirmations.by_user.get(user_id, ())):
+                if level not in kept:
+                    self.confirmations.remove(user_id, level)
+                    logger.info(f"Cancelled confirmation for chat_id={user_id}: level {level:.6f} removed")
+            storage.queue_levels(user_id, levels)
             logger.debug(f"Saved levels for user_id={user_id}: {levels}")
         except Exception as e:
             logger.error(f"Error saving levels for user_id={user_id}: {str(e)}")
 
-    async def save_user_stats(self, user_id):
-        try:
-            logger.debug(f"Saved stats for user_id={user_id}")
-        except Exception as e:
-            logger.error(f"Error saving stats for user_id={user_id}: {str(e)}")
-
     async def set_silent_hours(self, chat_id, time_range):
         try:
             start_str, end_str = time_range.split('-')
             start_time = datetime.strptime(start_str, "%H:%M").time()
             end_time = datetime.strptime(end_str, "%H:%M").time()
             self.user_states[chat_id]['silent_hours'] = (start_time, end_time)
+            if is_silent_hour(chat_id, datetime.now(pytz.timezone('Europe/Kyiv'))) and chat_id in self.confirmations.by_user:
+                # Новые подтверждения в тихие часы не начинаются — незавершённые тоже не должны дойти до уведомления
+                self.confirmations.cancel_user(chat_id)
+                logger.info(f"Cancelled pending confirmations for chat_id={chat_id}: silent hours started")
+            storage.queue_silent_hours(chat_id, (start_time, end_time))
             logger.info(f"Set silent hours for chat_id={chat_id}: {start_time}-{end_time}")
             return True, f"Тихие Часы установлены: {start_str}-{end_str}"
         except ValueError as e:
@@ -177,90 +262,152 @@ class BotState:
             logger.error(f"Error setting silent hours for chat_id={chat_id}: {str(e)}")
             return False, f"Ошибка: {str(e)}"
 
-    async def update_message(self, chat_id, text, reply_markup=None):
+    async def update_message(self, chat_id, text, reply_markup=None, priority=PRIORITY_REPLY):
+        """Обновление сообщения чата через очередь отправки; ждёт, пока оно (или более новое) будет доставлено"""
+        await self.dispatcher.submit(chat_id, text, reply_markup, priority)
+
+    def post_alert(self, chat_id, text, reply_markup=None):
+        """Уведомление без ожидания доставки: рассылка по многим чатам не ждёт лимитов каждого"""
+        future = self.dispatcher.post(chat_id, text, reply_markup, PRIORITY_ALERT)
+        future.add_done_callback(functools.partial(log_alert_failure, chat_id))
+
+    async def deliver_message(self, chat_id, text, reply_markup=None, priority=PRIORITY_REPLY):
+        """Показ text в сообщении чата: без запроса, если ничего не изменилось; правка, если можно; новое сообщение — если нужна другая клавиатура или старого сообщения нет.
+        Уведомление всегда уходит новым сообщением: правка не вызывает оповещения у пользователя"""
+        if priority == PRIORITY_ALERT:
+            await self.send_alert(chat_id, text, reply_markup)
+            return
+        previous = self.rendered.get(chat_id)
+        if reply_markup is None:
+            markup_hash = previous[1] if previous else None  # Клавиатура остаётся прежней
+        else:
+            markup_hash = hash(reply_markup.model_dump_json(exclude_none=True))
+        rendered = (hash(text), markup_hash)
+        message_id = self.message_ids.get(chat_id)
+        if message_id is not None and rendered == previous:
+            logger.debug(f"Message for chat_id={chat_id} unchanged, skipping edit")
+            return
+
+        inline = isinstance(reply_markup, types.InlineKeyboardMarkup)
+        # Обычную клавиатуру нельзя сменить правкой сообщения — для неё нужно новое сообщение
+        keyboard_changed = reply_markup is not None and not inline and (previous is None or previous[1] != markup_hash)
         try:
-            if chat_id in self.message_ids:
+            if message_id is not None and not keyboard_changed:
                 try:
-                    await self.bot.edit_message_text(text, chat_id, self.message_ids[chat_id], parse_mode="HTML", reply_markup=reply_markup)
-                    logger.debug(f"Edited message_id={self.message_ids[chat_id]} for chat_id={chat_id}")
-                except Exception:
-                    msg = await self.bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
-                    self.message_ids[chat_id] = msg.message_id
-                    logger.debug(f"Sent new message_id={msg.message_id} for chat_id={chat_id}")
-            else:
-                msg = await self.bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
-                self.message_ids[chat_id] = msg.message_id
-                logger.debug(f"Sent new message_id={msg.message_id} for chat_id={chat_id}")
+                    await self.bot.edit_message_text(
+                        text=text, chat_id=chat_id, message_id=message_id, parse_mode="HTML",
+                        reply_markup=reply_markup if inline else None
+                    )
+                    self.rendered[chat_id] = rendered
+                    logger.debug(f"Edited message_id={message_id} for chat_id={chat_id}")
+                    return
+                except Exception as e:
+                    kind = classify_telegram_error(e)
+                    if kind == "not_modified":
+                        self.rendered[chat_id] = rendered
+                        return
+                    if kind != "gone":
+                        raise
+                    logger.info(f"message_id={message_id} for chat_id={chat_id} is gone, sending a new one")
+            msg = await self.bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
+            self.message_ids[chat_id] = msg.message_id
+            self.rendered[chat_id] = rendered
+            logger.debug(f"Sent new message_id={msg.message_id} for chat_id={chat_id}")
         except Exception as e:
             logger.error(f"Failed to send/edit message to chat_id={chat_id}: {e}")
             raise
 
+    async def send_alert(self, chat_id, text, reply_markup=None):
+        try:
+            msg = await self.bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Failed to send alert to chat_id={chat_id}: {e}")
+            raise
+        # Следующий ответ меню появится под уведомлением, а не перезапишет его или сообщение выше
+        self.message_ids.pop(chat_id, None)
+        self.rendered.pop(chat_id, None)
+        logger.debug(f"Sent alert message_id={msg.message_id} for chat_id={chat_id}")
+
     async def reset_notified_levels(self, chat_id):
         self.user_states[chat_id]['notified_levels'].clear()
         logger.info(f"Cleared notified levels for chat_id={chat_id}")
 
-    async def confirm_level_crossing(self, chat_id, initial_value, direction, target_level):
+    def start_confirmation(self, chat_id, sample, direction, target_level):
+        """Начало подтверждения пересечения: дальше его ведут новые замеры из gas_bus"""
         kyiv_tz = pytz.timezone('Europe/Kyiv')
         now_kyiv = datetime.now(kyiv_tz)
         if is_silent_hour(chat_id, now_kyiv):
             logger.info(f"Silent hours active for chat_id={chat_id}, skipping notification for level={target_level:.6f}")
             return
 
-        if target_level not in self.user_states[chat_id]['confirmation_states']:
-            self.user_states[chat_id]['confirmation_states'][target_level] = {
-                'count': 0, 'values': [], 'target_level': target_level, 'direction': direction
-            }
-        state = self.user_states[chat_id]['confirmation_states'][target_level]
-        state['count'] = 1
-        state['values'] = [initial_value]
-        logger.info(f"Starting confirmation for chat_id={chat_id}: {initial_value:.6f} Gwei, direction: {direction}, target: {target_level:.6f}")
-
-        for i in range(CONFIRMATION_COUNT - 1):
-            await asyncio.sleep(CONFIRMATION_INTERVAL)
-            current_slow = await self.scanner.get_current_gas()
-            if current_slow is None:
-                logger.error(f"Failed to get gas on attempt {i + 2} for chat_id={chat_id}")
-                state['count'] = 0
-                state['values'] = []
-                del self.user_states[chat_id]['confirmation_states'][target_level]
-                return
-            state['count'] += 1
-            state['values'].append(current_slow)
-            logger.debug(f"Attempt {i + 2} for chat_id={chat_id}: {current_slow:.6f} Gwei")
-
-        values = state['values']
-        is_confirmed = False
-        if direction == 'down' and all(v <= target_level for v in values):
-            is_confirmed = True
-        elif direction == 'up' and all(v >= target_level for v in values):
-            is_confirmed = True
-
-        if is_confirmed and target_level not in self.user_states[chat_id]['notified_levels']:
+        self.confirmations.add(PendingConfirmation(chat_id, target_level, direction, sample, CONFIRMATION_WINDOW))
+        logger.info(f"Starting confirmation for chat_id={chat_id}: {sample.value:.6f} Gwei, direction: {direction}, target: {target_level:.6f}")
+
+    async def process_confirmations(self, sample):
+        """Учёт нового замера во всех незавершённых подтверждениях"""
+        for confirmation in self.confirmations.active():
+            if sample.block is not None and confirmation.last_block is not None:
+                if sample.block <= confirmation.last_block:
+                    continue
+            elif sample.timestamp <= confirmation.last_time:
+                continue
+            confirmation.last_block = sample.block
+            confirmation.last_time = sample.timestamp
+            confirmation.count += 1
+            confirmation.values.append(sample.value)
+            logger.debug(f"Confirmation sample {confirmation.count} for chat_id={confirmation.chat_id}: {sample.value:.6f} Gwei")
+
+            on_side = confirmation.on_side(sample.value)
+            window_passed = time_module.time() >= confirmation.deadline
+            # count включает замер, на котором пересечение обнаружено, поэтому следующих блоков count - 1
+            if not on_side or confirmation.count - 1 >= CONFIRMATION_BLOCKS or window_passed:
+                self.confirmations.remove(confirmation.chat_id, confirmation.target_level)
+                await self.finish_confirmation(confirmation.chat_id, confirmation, on_side)
+
+    async def expire_confirmation(self, confirmation):
+        """Окно подтверждения истекло без нового замера — решение по уже собранным значениям"""
+        await self.finish_confirmation(confirmation.chat_id, confirmation, confirmation.on_side(confirmation.values[-1]))
+
+    async def finish_confirmation(self, chat_id, confirmation, on_side):
+        target_level = confirmation.target_level
+        direction = confirmation.direction
+        values = confirmation.values
+        is_confirmed = on_side and len(values) >= CONFIRMATION_MIN_VALUES
+        if direction == 'down':
+            is_confirmed = is_confirmed and all(v <= target_level for v in values)
+        else:
+            is_confirmed = is_confirmed and all(v >= target_level for v in values)
+
+        already_notified = target_level in self.user_states[chat_id]['notified_levels']
+        if is_confirmed:
+            # Якорь переносится при любом подтверждённом пересечении, иначе пользователь
+            # с уже отправленным уведомлением попадает в users_to_check на каждом замере
+            last_measured = values[-1]
+            self.user_states[chat_id]['last_measured_gas'] = last_measured
+            self.set_anchor(chat_id, last_measured)
+
+        if is_confirmed and not already_notified:
             logger.info(f"Confirmation successful for chat_id={chat_id}, target={target_level:.6f}, values={values}")
-            last_measured = self.user_states[chat_id]['last_measured_gas']
             notification_message = (
                 f"<pre>{'🟩' if direction == 'down' else '🟥'} ◆ ГАЗ {'УМЕНЬШИЛСЯ' if direction == 'down' else 'УВЕЛИЧИЛСЯ'} до: {values[-1]:.6f} Gwei\n"
                 f"Уровень: {target_level:.6f} Gwei подтверждён</pre>"
             )
-            await self.update_message(chat_id, notification_message, create_main_keyboard(chat_id))
+            self.post_alert(chat_id, notification_message, create_main_keyboard(chat_id))
             self.user_states[chat_id]['notified_levels'].add(target_level)
             self.user_states[chat_id]['active_level'] = target_level
-            self.user_states[chat_id]['prev_level'] = last_measured
             logger.info(f"Level {target_level:.6f} confirmed for chat_id={chat_id}, notified")
         else:
-            logger.info(f"Confirmation failed or already notified for chat_id={chat_id}, target={target_level:.6f}, is_confirmed={is_confirmed}, notified={target_level in self.user_states[chat_id]['notified_levels']}")
+            logger.info(f"Confirmation failed or already notified for chat_id={chat_id}, target={target_level:.6f}, is_confirmed={is_confirmed}, notified={already_notified}")
 
-        state['count'] = 0
-        state['values'] = []
-        del self.user_states[chat_id]['confirmation_states'][target_level]
-
-    async def get_manta_gas(self, chat_id, force_base_message=False):
+    async def get_manta_gas(self, chat_id, force_base_message=False, sample=None):
         try:
-            current_slow = await self.scanner.get_current_gas()
-            if current_slow is None:
+            if sample is None:
+                sample = await self.scanner.gas_bus.sample(max_age=GAS_SAMPLE_MAX_AGE)
+            if sample is None:
                 await self.update_message(chat_id, "<b>⚠️ Не удалось подключиться к Manta Pacific</b>", create_main_keyboard(chat_id))
                 return
 
+            current_slow = sample.value
             logger.info(f"Gas for chat_id={chat_id}: Slow={current_slow:.6f}")
             gas_str = f"{current_slow:.6f}"
             decimal_part = gas_str.split('.')[1] if '.' in gas_str else ''
@@ -271,7 +418,17 @@ class BotState:
                 else:
                     break
             zeros_text = f"({leading_zeros})"
-            base_message = f"<pre>⛽️ Manta Pacific Gas\n◆ <b>ТЕКУЩИЙ ГАЗ</b>:   {current_slow:.6f} Gwei  {zeros_text}</pre>"
+            base_message = f"<pre>⛽️ Manta Pacific Gas\n◆ <b>ТЕКУЩИЙ ГАЗ</b>:   {current_slow:.6f} Gwei  {zeros_text}"
+            if force_base_message:
+                summary = self.scanner.gas_history.summary(sample.timestamp - GAS_SUMMARY_WINDOW, sample.timestamp)
+                if summary:
+                    base_message += (
+                        f"\n\n◆ ЗА 24 ЧАСА ({summary['count']} замеров):\n"
+                        f"◆ МИН:      {summary['min']:.6f} Gwei\n"
+                        f"◆ МЕДИАНА: ~{summary['p50']:.6f} Gwei\n"
+                        f"◆ МАКС:     {summary['max']:.6f} Gwei"
+                    )
+            base_message += "</pre>"
 
             self.user_states[chat_id]['last_measured_gas'] = current_slow
             prev_level = self.user_states[chat_id]['prev_level']
@@ -289,26 +446,23 @@ class BotState:
                     await self.update_message(chat_id, base_message + "\n\nУровни не заданы. Используйте 'Задать Уровни'.", create_main_keyboard(chat_id))
                 else:
                     logger.info(f"No levels set for chat_id={chat_id}, skipping notification check.")
-                self.user_states[chat_id]['prev_level'] = current_slow
+                self.set_anchor(chat_id, current_slow)
                 return
 
             if prev_level is None or force_base_message:
                 await self.update_message(chat_id, base_message, create_main_keyboard(chat_id))
-                self.user_states[chat_id]['prev_level'] = current_slow
+                self.set_anchor(chat_id, current_slow)
             else:
                 kyiv_tz = pytz.timezone('Europe/Kyiv')
                 now_kyiv = datetime.now(kyiv_tz)
                 if not is_silent_hour(chat_id, now_kyiv):
-                    sorted_levels = sorted(levels)
-                    closest_level = min(sorted_levels, key=lambda x: abs(x - current_slow))
-                    if prev_level < closest_level <= current_slow and closest_level not in self.user_states[chat_id]['confirmation_states']:
-                        logger.info(f"Detected upward crossing for chat_id={chat_id}: {closest_level:.6f}")
-                        asyncio.create_task(self.confirm_level_crossing(chat_id, current_slow, 'up', closest_level))
-                    elif prev_level > closest_level >= current_slow and closest_level not in self.user_states[chat_id]['confirmation_states']:
-                        logger.info(f"Detected downward crossing for chat_id={chat_id}: {closest_level:.6f}")
-                        asyncio.create_task(self.confirm_level_crossing(chat_id, current_slow, 'down', closest_level))
+                    direction, crossed_levels = self.user_states[chat_id]['level_index'].crossed(prev_level, current_slow)
+                    for level in crossed_levels:
+                        if (chat_id, level) not in self.confirmations:
+                            logger.info(f"Detected {'upward' if direction == 'up' else 'downward'} crossing for chat_id={chat_id}: {level:.6f}")
+                            self.start_confirmation(chat_id, sample, direction, level)
 
-            self.user_states[chat_id]['active_level'] = min(levels, key=lambda x: abs(x - current_slow))
+            self.user_states[chat_id]['active_level'] = self.user_states[chat_id]['level_index'].closest(current_slow)
 
         except Exception as e:
             logger.error(f"Error for chat_id={chat_id}: {e}")
@@ -318,38 +472,21 @@ class BotState:
         while True:
             try:
                 logger.debug("Running background price fetch")
-                await self.fetch_converter_data()
-                await self.fetch_l2_data()
+                await self.scanner.coin_markets.refresh(timeout=self.price_fetch_interval)
                 logger.debug("Background price fetch completed")
             except Exception as e:
                 logger.error(f"Error in background price fetch: {str(e)}")
             await asyncio.sleep(self.price_fetch_interval)
 
-    async def fetch_converter_data(self):
-        url = "https://api.coingecko.com/api/v3/coins/markets"
-        params = {
-            "vs_currency": "usd",
-            "ids": "manta-network,ethereum,bitcoin",
-            "order": "market_cap_desc",
-            "per_page": 3,
-            "page": 1,
-            "sparkline": "false"
-        }
+    def update_converter_cache(self, rows):
+        """Потребитель /coins/markets: цены для конвертера"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status != 200:
-                        logger.warning(f"CoinGecko API error for converter: {response.status}")
-                        return self.converter_cache
-                    data = await response.json()
-                    prices = {coin["id"]: coin["current_price"] for coin in data}
-                    self.converter_cache = prices
-                    self.converter_cache_time = datetime.now(pytz.timezone('Europe/Kyiv'))
-                    logger.debug("Converter data fetched and cached")
-                    return prices
+            prices = {coin_id: coin["current_price"] for coin_id, coin in rows.items()}
+            self.converter_cache = prices
+            self.converter_cache_time = datetime.now(pytz.timezone('Europe/Kyiv'))
+            logger.debug("Converter data fetched and cached")
         except Exception as e:
-            logger.error(f"Error fetching converter data: {str(e)}")
-            return self.converter_cache
+            logger.error(f"Error updating converter data: {str(e)}")
 
     async def convert_manta(self, chat_id, amount):
         try:
@@ -411,144 +548,87 @@ class BotState:
             await self.update_message(chat_id, "⚠️ Ошибка при расчёте стоимости газа.", create_main_keyboard(chat_id))
             return None
 
-    async def fetch_l2_data(self):
-        l2_tokens = {
-            "MANTA": "manta-network",
-            "Optimism": "optimism",
-            "Arbitrum": "arbitrum",
-            "Starknet": "starknet",
-            "ZKsync": "zksync",
-            "Scroll": "scroll",
-            "Mantle": "mantle",
-            "Taiko": "taiko"
-        }
+    def update_l2_cache(self, rows):
+        """Потребитель /coins/markets: данные для сравнения L2"""
         token_data = {}
-
-        url = "https://api.coingecko.com/api/v3/coins/markets"
-        params = {
-            "vs_currency": "usd",
-            "ids": ",".join(l2_tokens.values()),
-            "order": "market_cap_desc",
-            "per_page": 250,
-            "page": 1,
-            "sparkline": "false",
-            "price_change_percentage": "24h,7d,30d"
-        }
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status != 200:
-                        logger.warning(f"CoinGecko API error: {response.status}")
-                        return self.l2_data_cache or token_data
-                    data = await response.json()
-
-                    token_map = {coin["id"]: coin for coin in data}
-                    for name, token_id in l2_tokens.items():
-                        coin = token_map.get(token_id)
-                        if coin:
-                            price = coin.get("current_price", "Н/Д")
-                            price_change_24h = coin.get("price_change_percentage_24h", "Н/Д")
-                            price_change_7d = coin.get("price_change_percentage_7d_in_currency", "Н/Д")
-                            price_change_30d = coin.get("price_change_percentage_30d_in_currency", "Н/Д")
-                            price_change_all = ((price - coin.get("ath", price)) * 100 / coin.get("ath", price)) if price != "Н/Д" and coin.get("ath") else "Н/Д"
-                            ath_price = coin.get("ath", "Н/Д")
-                            ath_date = coin.get("ath_date", "Н/Д")
-                            if ath_date != "Н/Д":
-                                ath_date = datetime.strptime(ath_date, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
-                            atl_price = coin.get("atl", "Н/Д")
-                            atl_date = coin.get("atl_date", "Н/Д")
-                            if atl_date != "Н/Д":
-                                atl_date = datetime.strptime(atl_date, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
-                            token_data[name] = {
-                                "price": price,
-                                "24h": price_change_24h if price_change_24h is not None else "Н/Д",
-                                "7d": price_change_7d if price_change_7d is not None else "Н/Д",
-                                "30d": price_change_30d if price_change_30d is not None else "Н/Д",
-                                "all": price_change_all,
-                                "ath_price": ath_price,
-                                "ath_date": ath_date,
-                                "atl_price": atl_price,
-                                "atl_date": atl_date
-                            }
-                        else:
-                            token_data[name] = {
-                                "price": "Н/Д", "24h": "Н/Д", "7d": "Н/Д", "30d": "Н/Д", "all": "Н/Д",
-                                "ath_price": "Н/Д", "ath_date": "Н/Д", "atl_price": "Н/Д", "atl_date": "Н/Д"
-                            }
-
-                    self.l2_data_cache = token_data
-                    self.l2_data_time = datetime.now(pytz.timezone('Europe/Kyiv'))
-                    logger.debug("L2 data fetched and cached")
-                    return token_data
+            for token in registry.group("l2"):
+                name = token.name
+                coin = rows.get(token.coingecko_id)
+                if coin:
+                    price = coin.get("current_price", "Н/Д")
+                    price_change_24h = coin.get("price_change_percentage_24h", "Н/Д")
+                    price_change_7d = coin.get("price_change_percentage_7d_in_currency", "Н/Д")
+                    price_change_30d = coin.get("price_change_percentage_30d_in_currency", "Н/Д")
+                    price_change_all = ((price - coin.get("ath", price)) * 100 / coin.get("ath", price)) if price != "Н/Д" and coin.get("ath") else "Н/Д"
+                    ath_price = coin.get("ath", "Н/Д")
+                    ath_date = coin.get("ath_date", "Н/Д")
+                    if ath_date != "Н/Д":
+                        ath_date = datetime.strptime(ath_date, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
+                    atl_price = coin.get("atl", "Н/Д")
+                    atl_date = coin.get("atl_date", "Н/Д")
+                    if atl_date != "Н/Д":
+                        atl_date = datetime.strptime(atl_date, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
+                    token_data[name] = {
+                        "price": price,
+                        "24h": price_change_24h if price_change_24h is not None else "Н/Д",
+                        "7d": price_change_7d if price_change_7d is not None else "Н/Д",
+                        "30d": price_change_30d if price_change_30d is not None else "Н/Д",
+                        "all": price_change_all,
+                        "ath_price": ath_price,
+                        "ath_date": ath_date,
+                        "atl_price": atl_price,
+                        "atl_date": atl_date
+                    }
+                else:
+                    token_data[name] = {
+                        "price": "Н/Д", "24h": "Н/Д", "7d": "Н/Д", "30d": "Н/Д", "all": "Н/Д",
+                        "ath_price": "Н/Д", "ath_date": "Н/Д", "atl_price": "Н/Д", "atl_date": "Н/Д"
+                    }
+
+            self.l2_data_cache = token_data
+            self.l2_rankings = self.rank_l2_tokens(token_data)
+            self.l2_data_time = datetime.now(pytz.timezone('Europe/Kyiv'))
+            logger.debug("L2 data fetched and cached")
         except Exception as e:
-            logger.error(f"Error fetching L2 data: {str(e)}")
-            return self.l2_data_cache or token_data
+            logger.error(f"Error updating L2 data: {str(e)}")
+
+    @staticmethod
+    def rank_l2_tokens(token_data):
+        """Порядок токенов по каждой метрике: столбец значений и одна сортировка индексов на метрику"""
+        names = list(token_data)
+        rankings = {}
+        for metric, _ in L2_METRICS:
+            column = [float(token_data[name][metric]) if token_data[name][metric] not in ("Н/Д", None) else float('-inf') for name in names]
+            order = sorted(range(len(names)), key=column.__getitem__, reverse=True)
+            rankings[metric] = [names[i] for i in order]
+        return rankings
 
     async def fetch_fear_greed(self):
-        current_time = datetime.now(pytz.timezone('Europe/Kyiv'))
-        if self.fear_greed_time and (current_time - self.fear_greed_time).total_seconds() < self.fear_greed_cooldown and self.fear_greed_cache:
+        """Индекс страха и жадности: полная история запрашивается только для пустой или дырявой сохранённой истории,
+        дальше — только точки с последнего сохранённого дня"""
+        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEY}
+        limit = self.fear_greed_history.fetch_limit()
+
+        status, data = await self.scanner.fetch_json(FEAR_GREED_URL, self.fear_greed_cooldown, params={"limit": limit}, headers=headers)
+        if status != 200:
+            logger.error(f"CMC Fear & Greed API error: {status}")
+            return self.fear_greed_cache
+        if "data" not in data or not data["data"]:
+            logger.error("No data returned from Fear & Greed API")
             return self.fear_greed_cache
 
-        url = "https://pro-api.coinmarketcap.com/v3/fear-and-greed/historical"
-        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEY}
-        params = {"limit": 30}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status != 200:
-                    logger.error(f"CMC Fear & Greed API error: {response.status}")
-                    return None
-                data = await response.json()
-                if "data" not in data or not data["data"]:
-                    logger.error("No data returned from Fear & Greed API")
-                    return None
-
-                fg_data = data["data"]
-                current = fg_data[0]
-                current_value = int(current["value"])
-                current_category = current["value_classification"]
-
-                yesterday = fg_data[1]
-                yesterday_value = int(yesterday["value"])
-                yesterday_category = yesterday["value_classification"]
-
-                week_ago = fg_data[7] if len(fg_data) > 7 else fg_data[-1]
-                week_ago_value = int(week_ago["value"])
-                week_ago_category = week_ago["value_classification"]
-
-                month_ago = fg_data[-1]
-                month_ago_value = int(month_ago["value"])
-                month_ago_category = month_ago["value_classification"]
-
-                year_data = fg_data[:365] if len(fg_data) > 365 else fg_data
-                year_values = [(int(d["value"]), d["timestamp"], d["value_classification"]) for d in year_data]
-                max_year = max(year_values, key=lambda x: x[0])
-                min_year = min(year_values, key=lambda x: x[0])
-                max_year_value, max_year_date, max_year_category = max_year
-                min_year_value, min_year_date, min_year_category = min_year
-
-                def parse_timestamp(ts):
-                    try:
-                        return datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%d.%m.%Y")
-                    except ValueError:
-                        return datetime.fromtimestamp(int(ts)).strftime("%d.%m.%Y")
-
-                max_year_date = parse_timestamp(max_year_date)
-                min_year_date = parse_timestamp(min_year_date)
-
-                fear_greed_data = {
-                    "current": {"value": current_value, "category": current_category},
-                    "yesterday": {"value": yesterday_value, "category": yesterday_category},
-                    "week_ago": {"value": week_ago_value, "category": week_ago_category},
-                    "month_ago": {"value": month_ago_value, "category": month_ago_category},
-                    "year_max": {"value": max_year_value, "date": max_year_date, "category": max_year_category},
-                    "year_min": {"value": min_year_value, "date": min_year_date, "category": min_year_category}
-                }
-
-                self.fear_greed_cache = fear_greed_data
-                self.fear_greed_time = current_time
-                return fear_greed_data
+        points = points_from_response(data["data"])
+        if limit == FEAR_GREED_BACKFILL_LIMIT:
+            self.fear_greed_history.rebuild(list(self.fear_greed_history.points) + points)
+        else:
+            self.fear_greed_history.apply(points)
+        storage.queue_fear_greed(points)
+        fear_greed_data = self.fear_greed_history.snapshot()
+
+        self.fear_greed_cache = fear_greed_data
+        self.fear_greed_time = datetime.now(pytz.timezone('Europe/Kyiv'))
+        return fear_greed_data
 
     async def get_manta_price(self, chat_id):
         try:
@@ -569,8 +649,10 @@ class BotState:
             atl_price = manta_data["atl_price"]
             atl_date = manta_data["atl_date"]
 
-            spot_volume = await self.scanner.get_manta_spot_volume()
-            futures_volume = await self.scanner.get_manta_futures_volume()
+            spot_volume, futures_volume = await asyncio.gather(
+                self.scanner.get_manta_spot_volume(),
+                self.scanner.get_manta_futures_volume()
+            )
             spot_volume_m = round(spot_volume / Decimal('1000000')) if spot_volume else 0
             futures_volume_m = round(futures_volume / Decimal('1000000')) if futures_volume else 0
             spot_volume_str = f"{spot_volume_m}M$" if spot_volume else "Н/Д"
@@ -612,50 +694,14 @@ class BotState:
             message = (
                 f"<pre>"
                 f"🦅 Данные с CoinGecko:\n"
-                f"◆ Сравнение L2 токенов (24 часа):\n\n"
-            )
-            sorted_by_24h = sorted(
-                token_data.items(),
-                key=lambda x: float(x[1]["24h"]) if x[1]["24h"] not in ("Н/Д", None) else float('-inf'),
-                reverse=True
-            )
-            for name, data in sorted_by_24h:
-                price_str = f"${float(data['price']):.4f}" if data['price'] not in ("Н/Д", None) else "Н/Д"
-                change_str = f"{float(data['24h']):>6.2f}%" if data['24h'] not in ("Н/Д", None) else "Н/Д"
-                message += f"◆ {name:<9}: {price_str} | {change_str}\n"
-
-            message += "\n◆ Сравнение L2 токенов (7 дней):\n"
-            sorted_by_7d = sorted(
-                token_data.items(),
-                key=lambda x: float(x[1]["7d"]) if x[1]["7d"] not in ("Н/Д", None) else float('-inf'),
-                reverse=True
             )
-            for name, data in sorted_by_7d:
-                price_str = f"${float(data['price']):.4f}" if data['price'] not in ("Н/Д", None) else "Н/Д"
-                change_str = f"{float(data['7d']):>6.2f}%" if data['7d'] not in ("Н/Д", None) else "Н/Д"
-                message += f"◆ {name:<9}: {price_str} | {change_str}\n"
-
-            message += "\n◆ Сравнение L2 токенов (месяц):\n"
-            sorted_by_30d = sorted(
-                token_data.items(),
-                key=lambda x: float(x[1]["30d"]) if x[1]["30d"] not in ("Н/Д", None) else float('-inf'),
-                reverse=True
-            )
-            for name, data in sorted_by_30d:
-                price_str = f"${float(data['price']):.4f}" if data['price'] not in ("Н/Д", None) else "Н/Д"
-                change_str = f"{float(data['30d']):>6.2f}%" if data['30d'] not in ("Н/Д", None) else "Н/Д"
-                message += f"◆ {name:<9}: {price_str} | {change_str}\n"
-
-            message += "\n◆ Сравнение L2 токенов (все время):\n"
-            sorted_by_all = sorted(
-                token_data.items(),
-                key=lambda x: float(x[1]["all"]) if x[1]["all"] not in ("Н/Д", None) else float('-inf'),
-                reverse=True
-            )
-            for name, data in sorted_by_all:
-                price_str = f"${float(data['price']):.4f}" if data['price'] not in ("Н/Д", None) else "Н/Д"
-                change_str = f"{float(data['all']):>6.2f}%" if data['all'] != "Н/Д" else "Н/Д"
-                message += f"◆ {name:<9}: {price_str} | {change_str}\n"
+            for index, (metric, title) in enumerate(L2_METRICS):
+                message += f"◆ Сравнение L2 токенов ({title}):\n\n" if index == 0 else f"\n◆ Сравнение L2 токенов ({title}):\n"
+                for name in self.l2_rankings.get(metric, token_data):
+                    data = token_data[name]
+                    price_str = f"${float(data['price']):.4f}" if data['price'] not in ("Н/Д", None) else "Н/Д"
+                    change_str = f"{float(data[metric]):>6.2f}%" if data[metric] not in ("Н/Д", None) else "Н/Д"
+                    message += f"◆ {name:<9}: {price_str} | {change_str}\n"
             message += "</pre>"
 
             await self.update_message(chat_id, message, create_main_keyboard(chat_id))
@@ -707,18 +753,23 @@ class BotState:
             logger.error(f"Error fetching Fear & Greed for chat_id={chat_id}: {e}")
             await self.update_message(chat_id, f"<b>⚠️ Ошибка:</b> {str(e)}", create_main_keyboard(chat_id))
 
-    async def get_admin_stats(self, chat_id):
+    async def get_admin_stats(self, chat_id, start=None, end=None):
+        """Статистика за [start, end] (ISO даты), по умолчанию за сегодня"""
         if chat_id != ADMIN_ID:
             await self.update_message(chat_id, "Доступ только для админа.", create_main_keyboard(chat_id))
             return
         today = datetime.now(pytz.timezone('Europe/Kyiv')).date().isoformat()
-        message = "<b>Статистика использования бота за сегодня:</b>\n\n<pre>"
+        start = start or today
+        end = end or today
+        period = "сегодня" if start == end == today else (start if start == end else f"{start} — {end}")
+        usage = self.usage_stats.range(start, end)
+        message = f"<b>Статистика использования бота за {period}:</b>\n\n<pre>"
         has_activity = False
         for user_id, user_name in ALLOWED_USERS:
             if user_id == ADMIN_ID:
                 continue
-            stats = self.user_stats.get(user_id, {}).get(today, {})
-            if any(stats.values()):
+            stats = usage.get(user_id, {})
+            if stats:
                 message += f"{user_id} {user_name}\n"
                 for action, count in stats.items():
                     if count > 0:
@@ -727,7 +778,8 @@ class BotState:
                 has_activity = True
         message += "</pre>"
         if not has_activity:
-            message = "<b>Статистика использования бота за сегодня:</b>\n\nСегодня никто из пользователей (кроме админа) не использовал бота."
+            message = f"<b>Статистика использования бота за {period}:</b>\n\nЗа этот период никто из пользователей (кроме админа) не использовал бота."
+        message += f"\n\nПодтверждений уровней в ожидании: {len(self.confirmations)}"
         await self.update_message(chat_id, message, create_main_keyboard(chat_id))
 
 def create_main_keyboard(chat_id):
@@ -807,6 +859,32 @@ async def start_command(message: types.Message):
     except Exception as e:
         logger.error(f"Failed to delete start command message_id={message.message_id}: {e}")
 
+@state.dp.message(Command("stats"))
+async def stats_command(message: types.Message):
+    """/stats — сегодня, /stats 7 — последние 7 дней, /stats 2024-01-01 2024-01-31 — диапазон"""
+    if not await state.check_access(message):
+        return
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+    today = datetime.now(pytz.timezone('Europe/Kyiv')).date()
+    try:
+        if len(args) == 1 and args[0].isdigit():
+            days = int(args[0])
+            if days < 1:
+                raise ValueError(f"Number of days must be positive: {days}")
+            start, end = (today - timedelta(days=days - 1)).isoformat(), today.isoformat()
+        elif len(args) in (1, 2):
+            start = date.fromisoformat(args[0]).isoformat()
+            end = date.fromisoformat(args[-1]).isoformat()
+            if start > end:
+                raise ValueError(f"Range start {start} is after end {end}")
+        else:
+            start = end = None
+    except (ValueError, OverflowError):  # OverflowError — слишком большое число дней для timedelta/date
+        await state.update_message(chat_id, "Формат: /stats, /stats 7 или /stats 2024-01-01 2024-01-31", create_main_keyboard(chat_id))
+        return
+    await state.get_admin_stats(chat_id, start, end)
+
 @state.dp.message(lambda message: message.text in [
     "Газ", "Manta Price", "Сравнение L2", "Страх и Жадность",
     "Задать Уровни", "Уведомления", "Админ", "Тихие Часы", "Меню", "Назад",
@@ -819,10 +897,7 @@ async def handle_main_button(message: types.Message):
     text = message.text
     logger.debug(f"Button pressed: {text} by chat_id={chat_id}")
 
-    today = datetime.now(pytz.timezone('Europe/Kyiv')).date().isoformat()
-    if text not in ["Меню", "Назад"]:
-        state.user_stats[chat_id][today][text] += 1
-        await state.save_user_stats(chat_id)
+    state.usage_stats.increment(chat_id, text)
 
     if chat_id in state.pending_commands and text not in ["Задать Уровни", "Тихие Часы", "Manta Конвертер", "Газ Калькулятор"]:
         del state.pending_commands[chat_id]
@@ -956,6 +1031,7 @@ async def process_value(message: types.Message):
             await state.update_message(chat_id, "Возврат в меню.", create_menu_keyboard())
         elif text == "Отключить Тихие Часы":
             state.user_states[chat_id]['silent_hours'] = (None, None)
+            storage.queue_silent_hours(chat_id, (None, None))
             logger.info(f"Disabled silent hours for chat_id={chat_id}")
             del state.pending_commands[chat_id]
             await state.update_message(chat_id, "Тихие Часы отключены.", create_main_keyboard(chat_id))
@@ -1071,27 +1147,30 @@ async def process_value(message: types.Message):
         logger.error(f"Failed to delete user message_id={message.message_id}: {e}")
 
 async def monitor_gas_callback():
+    """Обработка замеров газа из общей шины: один замер на всех пользователей"""
+    queue = state.scanner.gas_bus.subscribe()
     while True:
         try:
-            gas_value = await state.scanner.get_current_gas()
+            sample = await queue.get()
+            gas_value = sample.value
             if state.is_first_run:
-                for user_id, _ in ALLOWED_USERS:
+                for user_id in list(state.unanchored):
                     state.user_states[user_id]['last_measured_gas'] = gas_value
-                    state.user_states[user_id]['prev_level'] = gas_value
+                    state.set_anchor(user_id, gas_value)
                     logger.info(f"First run: user_id={user_id}, gas_value={gas_value:.6f}")
                 state.is_first_run = False
             else:
-                for user_id, _ in ALLOWED_USERS:
+                await state.process_confirmations(sample)
+                # Только пользователи, у которых пересечён уровень, а не все подряд
+                for user_id in state.users_to_check(gas_value):
                     try:
-                        await state.get_manta_gas(user_id)
+                        await state.get_manta_gas(user_id, sample=sample)
                     except Exception as e:
                         logger.error(f"Failed to update gas for user_id={user_id}: {e}")
         except Exception as e:
             logger.error(f"Error in monitor_gas_callback: {str(e)}")
-        await asyncio.sleep(INTERVAL)
 
 async def schedule_restart():
-    global scanner, state
     last_restart_day = None
     kyiv_tz = pytz.timezone('Europe/Kyiv')
     while True:
@@ -1109,26 +1188,7 @@ async def schedule_restart():
                     if now >= restart_datetime and (last_restart_day is None or current_day != last_restart_day):
                         logger.info(f"Starting bot restart at {restart_time} Kyiv time")
                         try:
-                            for user_id, _ in ALLOWED_USERS:
-                                await state.save_user_stats(user_id)
-                                await state.save_levels(user_id, state.user_states[user_id]['current_levels'])
-                            await scanner.close()
-                            state.l2_data_cache = None
-                            state.l2_data_time = None
-                            state.fear_greed_cache = None
-                            state.fear_greed_time = None
-                            state.converter_cache = None
-                            logger.info("Caches cleared")
-                            scanner = Scanner()
-                            await scanner.init_session()
-                            state = BotState(scanner)
-                            for user_id, _ in ALLOWED_USERS:
-                                await state.init_user_state(user_id)
-                                state.init_user_stats(user_id)
-                                logger.info(f"Restored user data for user_id={user_id}, current_levels={state.user_states[user_id]['current_levels']}")
-                            logger.info("User data restored")
-                            await state.set_menu_button()
-                            state.is_first_run = True
+                            await state.hot_reload()
                             logger.info(f"Restart completed at {restart_time} Kyiv time")
                             last_restart_day = current_day
                         except Exception as e:
@@ -1142,12 +1202,17 @@ async def main():
     try:
         await state.set_menu_button()
         await scanner.init_session()
-        for user_id, _ in ALLOWED_USERS:
-            await state.init_user_state(user_id)
-            state.init_user_stats(user_id)
+        await storage.connect()
+        await state.load_state()
         asyncio.create_task(state.background_price_fetcher())
         asyncio.create_task(monitor_gas_callback())
+        asyncio.create_task(scanner.stream_gas(INTERVAL))
+        asyncio.create_task(scanner.stream_market_data())
         asyncio.create_task(schedule_restart())
+        asyncio.create_task(storage.run_flusher())
+        asyncio.create_task(state.usage_stats.run_flusher())
+        asyncio.create_task(state.confirmations.run(state.expire_confirmation))
+        asyncio.create_task(state.dispatcher.run())
         await state.dp.start_polling(state.bot)
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
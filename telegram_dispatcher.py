@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Константы
+PRIORITY_ALERT = 0  # Уведомление о пересечении уровня
+PRIORITY_REPLY = 1  # Ответ на кнопку, обновление газа
+TELEGRAM_GLOBAL_RATE = 30  # Сообщений в секунду на бота
+TELEGRAM_CHAT_INTERVAL = 1.0  # Минимум секунд между сообщениями в один чат
+TELEGRAM_WORKERS = 4  # Параллельных отправителей
+TELEGRAM_MAX_RETRIES = 3  # Повторов после flood wait (retry_after)
+
+class OutboundJob:
+    """Ещё не отправленное сообщение чата; обновления меню схлопываются в одно, уведомления — нет"""
+    __slots__ = ('chat_id', 'text', 'reply_markup', 'priority', 'seq', 'futures', 'attempt')
+
+    def __init__(self, chat_id, text, reply_markup, priority, seq, future):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.priority = priority
+        self.seq = seq
+        self.futures = [future]
+        self.attempt = 0
+
+class OutboundDispatcher:
+    """Очередь исходящих сообщений Telegram: общий и по-чатовый лимиты, приоритеты и схлопывание обновлений одного чата"""
+    def __init__(self, send, workers=TELEGRAM_WORKERS, rate=TELEGRAM_GLOBAL_RATE, chat_interval=TELEGRAM_CHAT_INTERVAL):
+        self.send = send  # async send(chat_id, text, reply_markup, priority)
+        self.workers = workers
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.chat_interval = chat_interval
+        self.jobs = {}  # chat_id -> куча (priority, seq, OutboundJob) неотправленных сообщений чата
+        self.latest = {}  # (chat_id, priority) -> неотправленное обновление, в которое схлопываются новые
+        self.heap = []  # (priority, seq, chat_id) первого сообщения каждого чата
+        self.next_allowed = {}  # chat_id -> monotonic время, раньше которого в чат не пишем
+        self.in_flight = set()
+        self.counter = itertools.count()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    async def submit(self, chat_id, text, reply_markup=None, priority=PRIORITY_REPLY):
+        """Постановка обновления в очередь и ожидание отправки его самого или более нового обновления этого чата"""
+        return await self.post(chat_id, text, reply_markup, priority)
+
+    def post(self, chat_id, text, reply_markup=None, priority=PRIORITY_REPLY):
+        """Постановка сообщения в очередь без ожидания, возвращает future доставки.
+        Обновление заменяет неотправленное обновление того же приоритета; уведомления ставятся каждое отдельно"""
+        future = asyncio.get_running_loop().create_future()
+        job = self.latest.get((chat_id, priority)) if priority != PRIORITY_ALERT else None
+        if job is not None:
+            self.coalesced += 1
+            job.text = text
+            job.reply_markup = reply_markup
+            job.futures.append(future)
+            return future
+        job = OutboundJob(chat_id, text, reply_markup, priority, next(self.counter), future)
+        self._enqueue(job)
+        if self.jobs[chat_id][0][2] is job:
+            self._push(chat_id)  # Новое первое сообщение чата
+        return future
+
+    def _enqueue(self, job):
+        heapq.heappush(self.jobs.setdefault(job.chat_id, []), (job.priority, job.seq, job))
+        if job.priority != PRIORITY_ALERT:
+            self.latest.setdefault((job.chat_id, job.priority), job)
+
+    def _push(self, chat_id):
+        if chat_id in self.in_flight or chat_id not in self.jobs:
+            return  # Вернётся в очередь после текущей отправки в этот чат
+        priority, seq, _ = self.jobs[chat_id][0]
+        heapq.heappush(self.heap, (priority, seq, chat_id))
+        self.ready.set()
+
+    def _push_later(self, chat_id, delay):
+        asyncio.get_running_loop().call_later(max(0, delay), self._push, chat_id)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _next_job(self):
+        while True:
+            while not self.heap:
+                self.ready.clear()
+                await self.ready.wait()
+            _, seq, chat_id = heapq.heappop(self.heap)
+            pending = self.jobs.get(chat_id)
+            if not pending or pending[0][1] != seq or chat_id in self.in_flight:
+                continue  # Устаревшая запись
+            wait = self.next_allowed.get(chat_id, 0) - time.monotonic()
+            if wait > 0:
+                self._push_later(chat_id, wait)
+                continue
+            _, _, job = heapq.heappop(pending)
+            if not pending:
+                del self.jobs[chat_id]
+            if self.latest.get((chat_id, job.priority)) is job:
+                del self.latest[(chat_id, job.priority)]
+            self.in_flight.add(chat_id)
+            return job
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            try:
+                self._refill()
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+                await self._deliver(job)
+            finally:
+                self.in_flight.discard(job.chat_id)
+                if job.chat_id in self.jobs:
+                    self._push_later(job.chat_id, self.next_allowed.get(job.chat_id, 0) - time.monotonic())
+
+    async def _deliver(self, job):
+        chat_id = job.chat_id
+        self.next_allowed[chat_id] = time.monotonic() + self.chat_interval
+        try:
+            await self.send(chat_id, job.text, job.reply_markup, job.priority)
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and job.attempt < TELEGRAM_MAX_RETRIES:
+                self.flood_waits += 1
+                self.next_allowed[chat_id] = time.monotonic() + retry_after
+                logger.warning(f"Flood wait for chat_id={chat_id}, retrying in {retry_after}s")
+                self._requeue(job)
+                return
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.sent += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_result(True)
+
+    def _requeue(self, job):
+        """Повтор после flood wait на прежнем месте очереди; если за это время пришло более новое обновление — отправится оно"""
+        newer = self.latest.get((job.chat_id, job.priority))
+        if newer is not None:
+            newer.futures.extend(job.futures)
+            return
+        job.attempt += 1
+        self._enqueue(job)
+
+    def stats(self):
+        self._refill()
+        return {
+            "queued": sum(len(pending) for pending in self.jobs.values()),
+            "in_flight": len(self.in_flight),
+            "tokens": round(self.tokens, 2),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "flood_waits": self.flood_waits
+        }
+
+    async def run(self):
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
@@ -0,0 +1,25 @@
+import os
+import sys
+from contextlib import asynccontextmanager
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@asynccontextmanager
+async def _serve(app):
+    """Локальный aiohttp сервер на свободном порту, отдаёт "127.0.0.1:порт" """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+@pytest.fixture
+def serve():
+    """async with serve(app) as host — заглушка внешнего сервиса на время теста"""
+    return _serve
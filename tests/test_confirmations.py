@@ -0,0 +1,61 @@
+import asyncio
+import os
+import time
+from decimal import Decimal
+import pytest
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:TEST-token-for-offline-tests")
+
+import telegram_bot as tb
+from monitoring_scanner import GasSample, Scanner
+
+USER = 1
+
+@pytest.fixture
+def state(monkeypatch):
+    """Отдельный BotState с перехваченными уведомлениями; is_silent_hour читает модульный state, поэтому он подменяется"""
+    bot_state = tb.BotState(Scanner())
+    bot_state.alerts = []
+    monkeypatch.setattr(bot_state, "post_alert", lambda chat_id, text, reply_markup=None: bot_state.alerts.append((chat_id, text)))
+    monkeypatch.setattr(tb, "state", bot_state)
+    asyncio.run(bot_state.init_user_state(USER, [Decimal("0.002"), Decimal("0.003")]))
+    bot_state.user_states[USER]['level_index'].update(bot_state.user_states[USER]['current_levels'])
+    bot_state.set_anchor(USER, Decimal("0.0025"))
+    return bot_state
+
+def sample(block, value):
+    return GasSample(time.time(), Decimal(value), block)
+
+def feed(state, first_block, count, value):
+    async def run():
+        for block in range(first_block, first_block + count):
+            await state.process_confirmations(sample(block, value))
+    asyncio.run(run())
+
+def test_confirmation_waits_for_confirmation_blocks_after_detection(state):
+    state.start_confirmation(USER, sample(100, "0.0035"), "up", Decimal("0.003"))
+    feed(state, 101, tb.CONFIRMATION_BLOCKS - 1, "0.0035")
+    assert (USER, Decimal("0.003")) in state.confirmations
+    assert state.alerts == []
+    feed(state, 101 + tb.CONFIRMATION_BLOCKS - 1, 1, "0.0035")
+    assert (USER, Decimal("0.003")) not in state.confirmations
+    assert len(state.alerts) == 1
+    assert state.user_states[USER]['prev_level'] == Decimal("0.0035")
+
+def test_removing_level_cancels_its_pending_confirmation(state):
+    state.start_confirmation(USER, sample(100, "0.0035"), "up", Decimal("0.003"))
+    state.start_confirmation(USER, sample(100, "0.0015"), "down", Decimal("0.002"))
+    asyncio.run(state.save_levels(USER, [Decimal("0.002"), Decimal("0.004")]))
+    assert (USER, Decimal("0.003")) not in state.confirmations
+    assert (USER, Decimal("0.002")) in state.confirmations  # Оставшийся уровень продолжает подтверждаться
+    feed(state, 101, tb.CONFIRMATION_BLOCKS, "0.0035")
+    assert all("0.003000 Gwei подтверждён" not in text for _, text in state.alerts)
+
+def test_enabling_silent_hours_cancels_pending_confirmations(state, monkeypatch):
+    state.start_confirmation(USER, sample(100, "0.0035"), "up", Decimal("0.003"))
+    monkeypatch.setattr(tb, "is_silent_hour", lambda user_id, now_kyiv: True)  # Тихие часы уже идут
+    ok, _ = asyncio.run(state.set_silent_hours(USER, "23:00-07:00"))
+    assert ok
+    assert USER not in state.confirmations.by_user
+    feed(state, 101, tb.CONFIRMATION_BLOCKS, "0.0035")
+    assert state.alerts == []
@@ -0,0 +1,28 @@
+from fear_greed import DAY, FEAR_GREED_BACKFILL_LIMIT, FEAR_GREED_UPDATE_LIMIT, FearGreedHistory, FearGreedPoint
+
+TODAY = 1_714_608_000  # Начало дня по UTC
+
+def series(days, skip=()):
+    """Дневные точки за последние days дней, кроме дней из skip (0 — сегодня)"""
+    return [FearGreedPoint(TODAY - ago * DAY, 50 + ago % 10, "Neutral") for ago in range(days - 1, -1, -1) if ago not in skip]
+
+def test_empty_history_needs_backfill():
+    assert FearGreedHistory().fetch_limit(TODAY) == FEAR_GREED_BACKFILL_LIMIT
+
+def test_contiguous_stored_history_fetches_only_missed_days():
+    history = FearGreedHistory()
+    history.load(series(30))
+    assert not history.needs_backfill
+    assert history.fetch_limit(TODAY + 3600) == FEAR_GREED_UPDATE_LIMIT
+    # Бот не работал три дня — запрашиваются только пропущенные дни
+    assert history.fetch_limit(TODAY + 3 * DAY + 3600) == 4
+
+def test_stored_history_with_gap_is_backfilled_and_merged():
+    history = FearGreedHistory()
+    history.load(series(30, skip={10, 11}))
+    assert history.needs_backfill
+    assert history.fetch_limit(TODAY + 3600) == FEAR_GREED_BACKFILL_LIMIT
+    history.rebuild(list(history.points) + series(30))
+    assert not history.needs_backfill and not history.has_gap()
+    assert len(history) == 30
+    assert history.days_ago(10).timestamp == TODAY - 10 * DAY
@@ -0,0 +1,79 @@
+import math
+import random
+from gas_history import GasHistory, GasRollup, HIST_BINS, HIST_MAX_GWEI, HIST_MIN_GWEI, value_to_bin
+
+def add(rollup, timestamp, value):
+    rollup.add(timestamp, value, value_to_bin(value))
+
+def buckets(rollup, start, end):
+    return [(rollup.bucket_ids[slot], rollup.counts[slot], rollup.mins[slot], rollup.maxs[slot]) for slot in rollup.slots(start, end)]
+
+def test_slot_is_reset_when_reused_after_wraparound():
+    rollup = GasRollup(60, 4)
+    add(rollup, 0, 0.001)
+    add(rollup, 30, 0.003)
+    add(rollup, 4 * 60, 0.002)  # Корзина 4 попадает в тот же слот 0
+    assert buckets(rollup, 0, 4 * 60) == [(4, 1, 0.002, 0.002)]
+    offset = (4 % 4) * HIST_BINS
+    assert sum(rollup.hist[offset:offset + HIST_BINS]) == 1
+    assert rollup.hist[offset + value_to_bin(0.002)] == 1
+
+def test_late_sample_older_than_slot_bucket_is_dropped():
+    rollup = GasRollup(60, 4)
+    add(rollup, 4 * 60, 0.002)
+    add(rollup, 10, 0.5)  # Корзина 0 уже вытеснена корзиной 4 в том же слоте
+    assert buckets(rollup, 0, 4 * 60) == [(4, 1, 0.002, 0.002)]
+
+def test_late_sample_within_retained_window_is_counted():
+    rollup = GasRollup(60, 4)
+    add(rollup, 3 * 60, 0.002)
+    add(rollup, 2 * 60 + 5, 0.004)  # Опоздавший замер в ещё хранящейся корзине
+    add(rollup, 3 * 60 + 1, 0.001)
+    assert buckets(rollup, 0, 3 * 60) == [(2, 1, 0.004, 0.004), (3, 2, 0.001, 0.002)]
+
+def test_slots_never_return_buckets_beyond_capacity():
+    rollup = GasRollup(60, 4)
+    for bucket_id in range(10):
+        add(rollup, bucket_id * 60, 0.001)
+    assert [bucket_id for bucket_id, *_ in buckets(rollup, 0, 9 * 60)] == [6, 7, 8, 9]
+    assert not rollup.covers(0, 9 * 60)
+    assert rollup.covers(6 * 60, 9 * 60)
+
+def test_histogram_bins_clamp_out_of_range_values():
+    assert value_to_bin(0) == 0
+    assert value_to_bin(HIST_MIN_GWEI) == 0
+    assert value_to_bin(HIST_MAX_GWEI) == HIST_BINS - 1
+    assert value_to_bin(HIST_MAX_GWEI * 100) == HIST_BINS - 1
+    bins = [value_to_bin(10 ** (math.log10(HIST_MIN_GWEI) + i * 0.05)) for i in range(120)]
+    assert bins == sorted(bins)
+
+def test_summary_matches_exact_statistics_within_bin_width():
+    history = GasHistory()
+    rng = random.Random(5)
+    values = [10 ** rng.uniform(-4, -2) for _ in range(2000)]
+    for i, value in enumerate(values):
+        history.add(1_000_000 + i * 2, value)
+    summary = history.summary(1_000_000, 1_000_000 + 4000)
+    ordered = sorted(values)
+    assert summary["count"] == len(values)
+    assert summary["min"] == ordered[0]
+    assert summary["max"] == ordered[-1]
+    assert math.isclose(summary["mean"], sum(values) / len(values))
+    for q in (50, 90, 99):
+        exact = ordered[int(q / 100 * len(values)) - 1]
+        assert abs(summary[f"p{q}"] / exact - 1) < 0.08  # Ширина корзины гистограммы ~7.5%
+
+def test_summary_outside_of_any_sample_is_none():
+    history = GasHistory()
+    history.add(1_000_000, 0.001)
+    assert history.summary(2_000_000, 2_000_100) is None
+
+def test_pick_resolution_and_raw_ring():
+    history = GasHistory(raw_capacity=3)
+    now = 1_700_000_000
+    for i in range(5):
+        history.add(now - 4 + i, 0.001 * (i + 1))
+    assert [value for _, value in history.raw(0, now)] == [0.003, 0.004, 0.005]
+    assert history.pick_resolution(now - 3600) == "1m"
+    assert history.pick_resolution(now - 10 * 86400) == "1h"
+    assert history.pick_resolution(now - 100 * 86400) == "1d"
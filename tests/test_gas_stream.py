@@ -0,0 +1,168 @@
+import asyncio
+import json
+from decimal import Decimal
+from aiohttp import web
+import monitoring_scanner as ms
+from http_client import http_client
+
+BASE_FEE_WS = 10 ** 9  # 1 Gwei в заголовках из WebSocket
+PRIORITY_FEE_WS = 10 ** 8  # 0.1 Gwei — 25-й перцентиль из eth_feeHistory
+HTTP_BLOCK = 150  # Блок, который отдаёт HTTP опрос
+BASE_FEE_HTTP = 2 * 10 ** 9
+
+class NodeStandIn:
+    """Заглушка узла Manta: newHeads по WebSocket и batch JSON-RPC по HTTP.
+    heads[i] — номера блоков для i-го подключения; после них соединение закрывается, кроме последнего"""
+    def __init__(self, heads):
+        self.heads = heads
+        self.connections = 0
+        self.http_requests = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.websocket)
+        app.router.add_post("/rpc", self.rpc)
+        return app
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connection = self.connections
+        self.connections += 1
+        blocks = self.heads[connection] if connection < len(self.heads) else []
+        async for msg in ws:
+            call = json.loads(msg.data)
+            if call["method"] == "eth_subscribe":
+                await ws.send_json({"jsonrpc": "2.0", "id": call["id"], "result": "0x1"})
+                for block in blocks:
+                    await ws.send_json({"jsonrpc": "2.0", "method": "eth_subscription", "params": {
+                        "subscription": "0x1",
+                        "result": {"number": hex(block), "baseFeePerGas": hex(BASE_FEE_WS)}
+                    }})
+                if connection < len(self.heads) - 1:
+                    asyncio.get_running_loop().call_later(0.3, lambda: asyncio.ensure_future(ws.close()))  # Обрыв после обработки блоков
+            elif call["method"] == "eth_feeHistory":
+                await ws.send_json({"jsonrpc": "2.0", "id": call["id"], "result": {
+                    "oldestBlock": call["params"][1],
+                    "baseFeePerGas": [hex(BASE_FEE_WS)] * 2,
+                    "gasUsedRatio": [0.5],
+                    "reward": [[hex(PRIORITY_FEE_WS)] * 3]
+                }})
+            else:
+                await ws.send_json({"jsonrpc": "2.0", "id": call["id"], "result": None})
+        return ws
+
+    async def rpc(self, request):
+        self.http_requests += 1
+        results = {
+            "eth_blockNumber": hex(HTTP_BLOCK),
+            "eth_chainId": hex(ms.MANTA_CHAIN_ID),
+            "eth_feeHistory": {
+                "oldestBlock": hex(HTTP_BLOCK),
+                "baseFeePerGas": [hex(BASE_FEE_HTTP)] * 2,
+                "gasUsedRatio": [0.5],
+                "reward": [["0x0"] * 3]
+            }
+        }
+        return web.json_response([{"jsonrpc": "2.0", "id": call["id"], "result": results[call["method"]]} for call in await request.json()])
+
+def make_scanner(host, ws_path="/ws"):
+    scanner = ms.Scanner()
+    scanner.rpc_pool = ms.RpcPool([f"http://{host}/rpc"])
+    scanner.ws_url = f"ws://{host}{ws_path}"
+    return scanner
+
+async def collect(queue, until, timeout=10):
+    """Замеры из очереди подписчика, пока until(samples) не станет истинным"""
+    samples = []
+    async def read():
+        while not until(samples):
+            samples.append(await queue.get())
+    await asyncio.wait_for(read(), timeout)
+    return samples
+
+def test_consume_new_heads_publishes_every_header(serve, monkeypatch):
+    monkeypatch.setattr(ms, "WS_HEAD_TIMEOUT", 0.5)
+    node = NodeStandIn([[100, 101, 102]])
+
+    async def scenario():
+        async with serve(node.app()) as host:
+            scanner = make_scanner(host)
+            queue = scanner.gas_bus.subscribe()
+            heads = await scanner.consume_new_heads()
+            return heads, [queue.get_nowait() for _ in range(queue.qsize())], scanner
+
+    heads, samples, scanner = asyncio.run(scenario())
+    assert heads == 3
+    assert [sample.block for sample in samples] == [100, 101, 102]
+    assert all(sample.value == Decimal("1.1") for sample in samples)
+    assert scanner.last_block_number == 102
+    assert node.http_requests == 0
+
+def test_consume_new_heads_skips_blocks_already_published_over_http(serve, monkeypatch):
+    monkeypatch.setattr(ms, "WS_HEAD_TIMEOUT", 0.5)
+    node = NodeStandIn([[100, 101, 102]])
+
+    async def scenario():
+        async with serve(node.app()) as host:
+            scanner = make_scanner(host)
+            scanner.last_block_number = 101  # HTTP опрос по кнопке успел дойти до блока 101
+            queue = scanner.gas_bus.subscribe()
+            heads = await scanner.consume_new_heads()
+            return heads, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    heads, samples = asyncio.run(scenario())
+    assert heads == 1
+    assert [sample.block for sample in samples] == [102]
+
+def test_stream_gas_falls_back_to_http_and_reconnects(serve, monkeypatch):
+    monkeypatch.setattr(ms, "WS_RECONNECT_MIN", 0.3)
+    monkeypatch.setattr(ms, "WS_HEAD_TIMEOUT", 5)
+    node = NodeStandIn([[100, 101], [200, 201]])
+
+    async def scenario():
+        async with serve(node.app()) as host:
+            scanner = make_scanner(host)
+            await scanner.init_session()
+            queue = scanner.gas_bus.subscribe()
+            task = asyncio.ensure_future(scanner.stream_gas(0.05))
+            try:
+                return await collect(queue, lambda samples: any(sample.block == 201 for sample in samples))
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await http_client.close()
+
+    samples = asyncio.run(scenario())
+    blocks = [sample.block for sample in samples]
+    # Первое подключение, HTTP опрос на время паузы, затем второе подключение
+    assert blocks[:3] == [100, 101, HTTP_BLOCK]
+    assert blocks[-2:] == [200, 201]
+    assert samples[2].value == Decimal("2")
+    assert node.connections == 2
+    assert node.http_requests >= 1
+
+def test_stream_gas_polls_http_while_websocket_is_down(serve, monkeypatch):
+    monkeypatch.setattr(ms, "WS_RECONNECT_MIN", 5)
+    node = NodeStandIn([])
+
+    async def scenario():
+        async with serve(node.app()) as host:
+            scanner = make_scanner(host, ws_path="/missing")
+            await scanner.init_session()
+            queue = scanner.gas_bus.subscribe()
+            task = asyncio.ensure_future(scanner.stream_gas(0.05))
+            try:
+                samples = await collect(queue, lambda samples: len(samples) >= 1)
+                # Новых блоков нет — опрос продолжается, а последний замер остаётся доступным
+                await asyncio.sleep(0.2)
+                return samples, await scanner.gas_bus.sample()
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await http_client.close()
+
+    samples, current = asyncio.run(scenario())
+    assert [sample.block for sample in samples] == [HTTP_BLOCK]
+    assert (current.block, current.value) == (HTTP_BLOCK, Decimal("2"))
+    assert node.http_requests >= 2
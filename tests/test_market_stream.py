@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+from aiohttp import web
+import monitoring_scanner as ms
+from http_client import http_client
+
+class BinanceStandIn:
+    """Заглушка Binance: REST 24hr тикеры и combined поток @ticker.
+    prices[i] — цена MANTAUSDT, которую присылает i-е подключение; все подключения, кроме последнего, затем закрываются"""
+    def __init__(self, prices):
+        self.prices = prices
+        self.connections = 0
+        self.streams = []
+        self.rest_requests = 0
+        self.rest_time = int(time.time() * 1000) - 5000  # REST отстаёт от потока
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/v3/ticker/24hr", self.rest)
+        app.router.add_get("/stream", self.stream)
+        return app
+
+    async def rest(self, request):
+        self.rest_requests += 1
+        return web.json_response([
+            {"symbol": symbol, "lastPrice": "1.0", "priceChangePercent": "0.5", "quoteVolume": "1000", "closeTime": self.rest_time}
+            for symbol in json.loads(request.query["symbols"])
+        ])
+
+    async def stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connection = self.connections
+        self.connections += 1
+        self.streams.append(request.query["streams"])
+        await ws.send_json({"stream": "mantausdt@ticker", "data": {
+            "e": "24hrTicker", "E": int(time.time() * 1000), "s": "MANTAUSDT",
+            "c": self.prices[connection], "P": "2.5", "q": "5000"
+        }})
+        if connection < len(self.prices) - 1:
+            await ws.close()
+        else:
+            async for _ in ws:
+                pass
+        return ws
+
+def test_apply_ticker_handles_ticker_and_mini_ticker():
+    scanner = ms.Scanner()
+    scanner.apply_ticker("spot", {"e": "24hrTicker", "E": 1700000000000, "s": "OPUSDT", "c": "1.5", "P": "3.2", "q": "900"})
+    scanner.apply_ticker("futures", {"e": "24hrMiniTicker", "E": 1700000000000, "s": "MANTAUSDT", "c": "1.1", "o": "1.0", "q": "700"})
+    assert scanner.quotes[("spot", "OPUSDT")] == {"lastPrice": "1.5", "priceChangePercent": "3.2", "quoteVolume": "900", "time": 1700000000.0}
+    mini = scanner.quotes[("futures", "MANTAUSDT")]
+    assert mini["lastPrice"] == "1.1"
+    assert float(mini["priceChangePercent"]) == 10.0
+
+def test_stream_tickers_resyncs_over_rest_and_reconnects(serve, monkeypatch):
+    monkeypatch.setattr(ms, "WS_RECONNECT_MIN", 0.1)
+    monkeypatch.setattr(ms, "CACHE_TTL_BINANCE", 0)  # Каждая синхронизация доходит до REST
+    binance = BinanceStandIn(["2.0", "3.0"])
+
+    async def scenario():
+        async with serve(binance.app()) as host:
+            monkeypatch.setitem(ms.BINANCE_STREAM_URLS, "spot", f"ws://{host}/stream?streams=")
+            monkeypatch.setitem(ms.BINANCE_TICKER_URLS, "spot", f"http://{host}/api/v3/ticker/24hr")
+            scanner = ms.Scanner()
+            await scanner.init_session()
+            task = asyncio.ensure_future(scanner.stream_tickers("spot"))
+            try:
+                async def streamed():
+                    while (scanner.get_quote("spot", "MANTAUSDT") or {}).get("lastPrice") != "3.0":
+                        await asyncio.sleep(0.02)
+                await asyncio.wait_for(streamed(), 10)
+                return scanner
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await http_client.close()
+
+    scanner = asyncio.run(scenario())
+    assert binance.connections == 2
+    assert binance.rest_requests == 2  # Синхронизация перед каждым подключением
+    assert binance.streams[0] == "/".join(f"{symbol.lower()}@ticker" for symbol in ms.BINANCE_STREAM_SYMBOLS["spot"])
+    # Символы без событий в потоке заполнены из REST
+    assert scanner.get_quote("spot", "OPUSDT")["lastPrice"] == "1.0"
+    assert scanner.get_quote("spot", "MANTAUSDT")["priceChangePercent"] == "2.5"
+
+def test_rest_resync_keeps_newer_streamed_quote(serve, monkeypatch):
+    binance = BinanceStandIn([])
+
+    async def scenario():
+        async with serve(binance.app()) as host:
+            monkeypatch.setitem(ms.BINANCE_TICKER_URLS, "spot", f"http://{host}/api/v3/ticker/24hr")
+            scanner = ms.Scanner()
+            await scanner.init_session()
+            try:
+                scanner.apply_ticker("spot", {"E": int(time.time() * 1000), "s": "MANTAUSDT", "c": "2.0", "P": "1.0", "q": "10"})
+                status = await scanner.refresh_binance_tickers("spot")
+                return status, scanner
+            finally:
+                await http_client.close()
+
+    status, scanner = asyncio.run(scenario())
+    assert status == 200
+    assert scanner.get_quote("spot", "MANTAUSDT")["lastPrice"] == "2.0"
+    assert scanner.get_quote("spot", "ARBUSDT")["lastPrice"] == "1.0"
@@ -0,0 +1,121 @@
+import asyncio
+import os
+from datetime import time
+from decimal import Decimal
+import asyncpg
+import pytest
+import storage as storage_module
+from storage import Storage
+
+# Тесты пишут в реальную базу: TEST_DATABASE_URL=postgresql://... python -m pytest tests
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+async def fresh_storage():
+    """Storage на пустых таблицах"""
+    conn = await asyncpg.connect(TEST_DATABASE_URL)
+    try:
+        await conn.execute("DROP TABLE IF EXISTS user_levels, user_settings, user_stats, fear_greed")
+    finally:
+        await conn.close()
+    store = Storage(TEST_DATABASE_URL)
+    await store.connect()
+    return store
+
+async def reload_all():
+    """load_all из нового экземпляра, как после перезапуска"""
+    store = Storage(TEST_DATABASE_URL)
+    await store.connect()
+    try:
+        return await store.load_all()
+    finally:
+        await store.close()
+
+def test_flush_and_load_all_round_trip():
+    async def scenario():
+        store = await fresh_storage()
+        try:
+            store.queue_levels(1, [Decimal("0.0123"), Decimal("0.01")])
+            store.queue_levels(1, [Decimal("0.02")])  # Повторная запись заменяет предыдущую
+            store.queue_levels(2, [])
+            store.queue_silent_hours(1, (time(23, 0), time(7, 0)))
+            store.queue_silent_hours(2, (None, None))
+            store.queue_stats(1, "2024-05-01", {"Газ": 3, "Меню": 1})
+            store.queue_stats(1, "2024-05-02", {"Газ": 1})
+            store.queue_fear_greed([(1714608000, 40, "Fear"), (1714521600, 55, "Neutral")])
+            store.queue_fear_greed([(1714608000, 42, "Fear")])  # Точка текущего дня обновилась
+            await store.flush()
+            assert not (store.pending_levels or store.pending_settings or store.pending_stats or store.pending_fear_greed)
+        finally:
+            await store.close()
+        return await reload_all()
+
+    levels, silent_hours, stats, fear_greed = asyncio.run(scenario())
+    assert levels == {1: [Decimal("0.02")], 2: []}
+    assert silent_hours == {1: (time(23, 0), time(7, 0)), 2: (None, None)}
+    assert stats == {1: {"2024-05-01": {"Газ": 3, "Меню": 1}, "2024-05-02": {"Газ": 1}}}
+    assert fear_greed == [(1714521600, 55, "Neutral"), (1714608000, 42, "Fear")]
+
+def test_large_stats_batch_goes_through_copy(monkeypatch):
+    monkeypatch.setattr(storage_module, "STORAGE_COPY_THRESHOLD", 10)
+    copied = []
+    copy_records_to_table = asyncpg.connection.Connection.copy_records_to_table
+
+    async def spy(self, table_name, **kwargs):
+        copied.append((table_name, len(kwargs["records"])))
+        return await copy_records_to_table(self, table_name, **kwargs)
+
+    monkeypatch.setattr(asyncpg.connection.Connection, "copy_records_to_table", spy)
+
+    async def scenario():
+        store = await fresh_storage()
+        try:
+            for user_id in range(5):
+                store.queue_stats(user_id, "2024-05-01", {f"action{i}": i + 1 for i in range(4)})
+            await store.flush()
+            # Повторная запись тех же ключей через COPY обновляет счётчики
+            for user_id in range(5):
+                store.queue_stats(user_id, "2024-05-01", {f"action{i}": 10 * (i + 1) for i in range(4)})
+            store.queue_stats(99, "2024-05-02", {"Газ": 1})  # 21 строка — снова выше порога
+            await store.flush()
+        finally:
+            await store.close()
+        return await reload_all()
+
+    _, _, stats, _ = asyncio.run(scenario())
+    assert copied == [("user_stats_incoming", 20), ("user_stats_incoming", 21)]
+    assert stats[3]["2024-05-01"] == {f"action{i}": 10 * (i + 1) for i in range(4)}
+    assert stats[99] == {"2024-05-02": {"Газ": 1}}
+
+def test_failed_flush_requeues_and_newer_changes_win():
+    async def scenario():
+        store = await fresh_storage()
+        try:
+            store.queue_levels(1, [Decimal("0.01")])
+            store.queue_silent_hours(1, (time(22, 0), time(6, 0)))
+            store.queue_stats(1, "2024-05-01", {"Газ": "not a number"})  # Ломает весь пакет
+            store.queue_fear_greed([(1714521600, 55, "Neutral")])
+            await store.flush()
+            requeued = (dict(store.pending_levels), dict(store.pending_settings), dict(store.pending_stats), dict(store.pending_fear_greed))
+            after_failure = await reload_all()
+
+            store.queue_levels(1, [Decimal("0.05")])
+            store.queue_stats(1, "2024-05-01", {"Газ": 2})
+            await store.flush()
+        finally:
+            await store.close()
+        return requeued, after_failure, await reload_all()
+
+    requeued, after_failure, (levels, silent_hours, stats, fear_greed) = asyncio.run(scenario())
+    assert requeued == (
+        {1: [Decimal("0.01")]},
+        {1: (time(22, 0), time(6, 0))},
+        {(1, "2024-05-01", "Газ"): "not a number"},
+        {1714521600: (55, "Neutral")}
+    )
+    assert after_failure == ({}, {}, {}, [])  # Транзакция откатилась целиком
+    assert levels == {1: [Decimal("0.05")]}
+    assert silent_hours == {1: (time(22, 0), time(6, 0))}
+    assert stats == {1: {"2024-05-01": {"Газ": 2}}}
+    assert fear_greed == [(1714521600, 55, "Neutral")]
@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+from usage_stats import UsageStats
+
+def days_ago(stats, days):
+    return (date.fromisoformat(stats.day) - timedelta(days=days)).isoformat()
+
+def make_stats():
+    """Два закрытых дня и текущий: по 1, 2 и 4 нажатия «Газ»"""
+    stats = UsageStats()
+    stats.load({1: {days_ago(stats, 2): {"Газ": 1}, days_ago(stats, 1): {"Газ": 2}}})
+    for _ in range(4):
+        stats.increment(1, "Газ")
+    return stats
+
+def test_range_combines_closed_days_and_live_counters():
+    stats = make_stats()
+    assert stats.range(days_ago(stats, 2), stats.day) == {1: {"Газ": 7}}
+    assert stats.range(days_ago(stats, 1), days_ago(stats, 1)) == {1: {"Газ": 2}}
+    assert stats.range(stats.day, days_ago(stats, -5)) == {1: {"Газ": 4}}
+
+def test_range_starting_after_today_is_empty():
+    stats = make_stats()
+    assert stats.range(days_ago(stats, -1), days_ago(stats, -3)) == {}
+
+def test_reversed_range_is_empty():
+    stats = make_stats()
+    assert stats.range(stats.day, days_ago(stats, 2)) == {}
@@ -0,0 +1,56 @@
+import json
+import logging
+import os
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Константы
+TOKENS_CONFIG = os.getenv("TOKENS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokens.json"))
+
+# Токен: отображаемое имя, id CoinGecko, символ Binance (None, если пары нет) и группы (l2, converter, ...)
+Token = namedtuple('Token', ['name', 'coingecko_id', 'binance_symbol', 'groups'])
+
+class TokenRegistry:
+    """Список отслеживаемых токенов из конфига с готовыми индексами поиска"""
+    def __init__(self, tokens):
+        self.build(tokens)
+
+    def build(self, tokens):
+        self.tokens = list(tokens)
+        self.by_name = {token.name: token for token in self.tokens}
+        self.by_coingecko_id = {token.coingecko_id: token for token in self.tokens}
+        self.by_binance_symbol = {token.binance_symbol: token for token in self.tokens if token.binance_symbol}
+        self.groups = {}
+        for token in self.tokens:
+            for group in token.groups:
+                self.groups.setdefault(group, []).append(token)
+        logger.info(f"Token registry loaded: {len(self.tokens)} tokens, groups: {', '.join(self.groups)}")
+
+    @classmethod
+    def load(cls, path=TOKENS_CONFIG):
+        return cls(cls.read(path))
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return [
+            Token(item["name"], item["coingecko_id"], item.get("binance_symbol"), tuple(item.get("groups", ())))
+            for item in config["tokens"]
+        ]
+
+    def reload(self, path=TOKENS_CONFIG):
+        """Перечитывание конфига на месте: все, кто импортировал registry, видят новые токены"""
+        self.build(self.read(path))
+
+    def group(self, name):
+        return self.groups.get(name, [])
+
+    def coingecko_ids(self, group):
+        return [token.coingecko_id for token in self.group(group)]
+
+    def binance_symbols(self, group):
+        return [token.binance_symbol for token in self.group(group) if token.binance_symbol]
+
+registry = TokenRegistry.load()
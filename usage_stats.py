@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import pytz
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Константы
+USAGE_ACTIONS = [
+    "Газ", "Manta Price", "Сравнение L2",
+    "Задать Уровни", "Уведомления", "Админ", "Страх и Жадность",
+    "Тихие Часы", "Manta Конвертер", "Газ Калькулятор"
+]
+USAGE_RETENTION_DAYS = 90  # Сколько дней статистики держать в памяти
+USAGE_FLUSH_INTERVAL = 10  # Как часто передавать изменённые счётчики в storage, сек
+KYIV_TZ = pytz.timezone('Europe/Kyiv')
+
+def add_counts(total, counts):
+    """total += counts для {user_id: {действие: счётчик}}, возвращает новый словарь"""
+    result = {user_id: dict(actions) for user_id, actions in total.items()}
+    for user_id, actions in counts.items():
+        user_total = result.setdefault(user_id, {})
+        for action, count in actions.items():
+            user_total[action] = user_total.get(action, 0) + count
+    return result
+
+class UsageStats:
+    """Счётчики нажатий по дням: текущий день в памяти, закрытые дни — накопительными итогами для запросов по диапазону"""
+    def __init__(self, retention_days=USAGE_RETENTION_DAYS):
+        self.retention_days = retention_days
+        self.closed_days = []  # ISO даты закрытых дней по возрастанию
+        self.cumulative = []  # Итоги с начала хранения по каждый закрытый день включительно
+        self.day = None
+        self.rollover_at = 0  # Unix время ближайшей полуночи по Киеву
+        self.current = {}  # user_id -> {действие: счётчик} за текущий день
+        self.dirty = set()  # (user_id, действие) текущего дня, ещё не переданные в storage
+        self._start_day(datetime.now(KYIV_TZ))
+
+    def _start_day(self, now):
+        self.day = now.date().isoformat()
+        midnight = KYIV_TZ.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+        self.rollover_at = midnight.timestamp()
+        self.current = {}
+
+    def _maybe_rollover(self):
+        if time.time() < self.rollover_at:
+            return
+        self.flush()  # Счётчики уходящего дня передаются в storage до переключения
+        self._close_day(self.day, self.current)
+        self._start_day(datetime.now(KYIV_TZ))
+        logger.info(f"Usage stats rolled over to {self.day}")
+
+    def _close_day(self, day, counts):
+        previous = self.cumulative[-1] if self.cumulative else {}
+        self.closed_days.append(day)
+        self.cumulative.append(add_counts(previous, counts))
+        # Итоги накопительные, поэтому разности между оставшимися днями не меняются
+        excess = len(self.closed_days) - self.retention_days
+        if excess > 0:
+            del self.closed_days[:excess]
+            del self.cumulative[:excess]
+
+    def load(self, stats):
+        """Начальное заполнение из storage: {user_id: {ISO дата: {действие: счётчик}}}"""
+        by_day = {}
+        for user_id, days in stats.items():
+            for day, actions in days.items():
+                by_day.setdefault(day, {})[user_id] = dict(actions)
+        self.closed_days = []
+        self.cumulative = []
+        oldest = (datetime.fromisoformat(self.day) - timedelta(days=self.retention_days)).date().isoformat()
+        for day in sorted(by_day):
+            if oldest <= day < self.day:
+                self._close_day(day, by_day[day])
+        self.current = by_day.get(self.day, {})
+        logger.info(f"Usage stats loaded: {len(self.closed_days)} days")
+
+    def increment(self, user_id, action):
+        if action not in USAGE_ACTIONS:
+            return
+        self._maybe_rollover()
+        actions = self.current.setdefault(user_id, {})
+        actions[action] = actions.get(action, 0) + 1
+        self.dirty.add((user_id, action))
+
+    def _total_before(self, day):
+        """Итоги по всем дням строго раньше day, включая текущий, если он раньше day"""
+        index = bisect_left(self.closed_days, day) - 1
+        total = self.cumulative[index] if index >= 0 else {}
+        return add_counts(total, self.current) if day > self.day else total
+
+    def _total_through(self, day):
+        """Итоги по всем дням по day включительно"""
+        index = bisect_right(self.closed_days, day) - 1
+        total = self.cumulative[index] if index >= 0 else {}
+        return add_counts(total, self.current) if day >= self.day else total
+
+    def range(self, start, end):
+        """Счётчики за [start, end] (ISO даты): {user_id: {действие: счётчик}} без нулевых значений"""
+        self._maybe_rollover()
+        if start > end or start > self.day:
+            return {}
+        through = self._total_through(end)
+        before = self._total_before(start)
+        result = {}
+        for user_id, actions in through.items():
+            previous = before.get(user_id, {})
+            counts = {action: count - previous.get(action, 0) for action, count in actions.items() if count - previous.get(action, 0) > 0}
+            if counts:
+                result[user_id] = counts
+        return result
+
+    def flush(self):
+        """Передача изменённых счётчиков текущего дня в storage для отложенной записи"""
+        if not self.dirty:
+            return
+        by_user = {}
+        for user_id, action in self.dirty:
+            by_user.setdefault(user_id, {})[action] = self.current[user_id][action]
+        self.dirty.clear()
+        for user_id, counts in by_user.items():
+            storage.queue_stats(user_id, self.day, counts)
+
+    async def run_flusher(self, interval=USAGE_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._maybe_rollover()
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in usage stats flusher: {str(e)}")
@@ -2,7 +2,9 @@ import os
 import logging
 import asyncio
 from aiohttp import web
-from telegram_bot import state, scanner, schedule_restart, monitor_gas_callback
+from telegram_bot import state, scanner, schedule_restart, monitor_gas_callback, INTERVAL
+from http_client import http_client
+from storage import storage
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,7 +35,13 @@ async def start_background_tasks():
         tasks = [
             asyncio.create_task(state.background_price_fetcher()),
             asyncio.create_task(schedule_restart()),
-            asyncio.create_task(scanner.monitor_gas(60, monitor_gas_callback))
+            asyncio.create_task(monitor_gas_callback()),
+            asyncio.create_task(scanner.stream_gas(INTERVAL)),
+            asyncio.create_task(scanner.stream_market_data()),
+            asyncio.create_task(storage.run_flusher()),
+            asyncio.create_task(state.usage_stats.run_flusher()),
+            asyncio.create_task(state.confirmations.run(state.expire_confirmation)),
+            asyncio.create_task(state.dispatcher.run())
         ]
         logger.info("Background tasks started")
         return tasks
@@ -46,6 +54,9 @@ async def init_bot(app):
     try:
         logger.info("Starting bot initialization")
         await scanner.init_session()  # Initialize aiohttp session
+        await scanner.warmup()
+        await storage.connect()
+        await state.load_state()
         await state.bot.set_webhook(WEBHOOK_URL)
         logger.info(f"Webhook set to {WEBHOOK_URL}")
         app['background_tasks'] = await start_background_tasks()
@@ -61,6 +72,10 @@ async def cleanup(app):
             task.cancel()
         await state.bot.delete_webhook()
         await scanner.close()
+        state.usage_stats.flush()
+        await storage.close()
+        await state.bot.session.close()
+        await http_client.close()
         logger.info("Cleanup completed")
     except Exception as e:
         logger.error(f"Error during cleanup: {str(e)}")